@@ -6,7 +6,7 @@ This demonstrates that darktable can decode and export a raw file
 WITHOUT ever knowing the filename - just working with a memory buffer.
 
 Steps:
-1. Load raw file into Python bytes object
+1. Memory-map raw file (read-only, paged in on demand)
 2. Pass buffer to darktable (NO filename!)
 3. darktable decodes from buffer
 4. darktable exports to JPEG
@@ -15,12 +15,17 @@ Steps:
 
 import sys
 import os
+import mmap
 
 # Add python_api to path
 sys.path.insert(0, '/tmp/darktable/src/cli/python_api')
 
 from _dt_api import ffi, lib
 
+# dt_init arguments, NUL-terminated so ffi.from_buffer can alias them as C strings
+_ARGS = (b"buffer-demo\0", b"--library\0", b":memory:\0",
+         b"--conf\0", b"write_sidecar_files=never\0")
+
 def demo_buffer_export():
     print("=" * 70)
     print("BUFFER-BASED EXPORT DEMONSTRATION")
@@ -42,17 +47,12 @@ def demo_buffer_export():
     print("STEP 1: Initialize darktable")
     print("=" * 70)
 
-    argv = [
-        ffi.new("char[]", b"buffer-demo"),
-        ffi.new("char[]", b"--library"),
-        ffi.new("char[]", b":memory:"),
-        ffi.new("char[]", b"--conf"),
-        ffi.new("char[]", b"write_sidecar_files=never"),
-    ]
-    argv_array = ffi.new("char*[]", argv)
+    # Only the pointer array is allocated; the strings alias _ARGS
+    argv_keepalive = [ffi.from_buffer("char[]", a) for a in _ARGS]
+    argv_array = ffi.new("char*[]", argv_keepalive)
 
     result = lib.dt_init(
-        5, argv_array, False, True, ffi.NULL,
+        len(_ARGS), argv_array, False, True, ffi.NULL,
         b"/home/glen/Applications/Darktable/bin"
     )
 
@@ -73,14 +73,16 @@ def demo_buffer_export():
 
     try:
         with open(input_raw, 'rb') as f:
-            raw_buffer = f.read()
+            # Map instead of read(): the kernel pages data in as darktable
+            # touches it, and there is no Python-side copy of the file
+            raw_buffer = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
     except Exception as e:
         print(f"✗ Failed to read file: {e}")
         lib.dt_cleanup()
         return 2
 
     buffer_size = len(raw_buffer)
-    print(f"✓ Loaded {buffer_size:,} bytes into Python memory")
+    print(f"✓ Mapped {buffer_size:,} bytes into Python memory")
     print(f"  Buffer type: {type(raw_buffer)}")
     print(f"  First 16 bytes (hex): {raw_buffer[:16].hex()}")
 
@@ -96,8 +98,11 @@ def demo_buffer_export():
     print("  → darktable will export to JPEG")
     print("  → darktable will NEVER touch the filesystem for raw data")
 
+    # Zero-copy view of the mapping (raw_buffer must outlive the call)
+    buf_cdata = ffi.from_buffer("uint8_t[]", raw_buffer)
+
     result = lib.dt_shim_export_from_buffer(
-        raw_buffer,              # Python bytes object → C uint8_t*
+        buf_cdata,               # mmap → C uint8_t* (no copy)
         buffer_size,             # size_t
         output_jpg.encode(),     # const char*
         jpeg_quality,            # int
@@ -105,6 +110,9 @@ def demo_buffer_export():
         0                        # max_height (0 = no limit)
     )
 
+    del buf_cdata
+    raw_buffer.close()
+
     if result != 0:
         print(f"✗ Export failed with code {result}")
         lib.dt_cleanup()
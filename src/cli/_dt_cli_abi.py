@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+ABI-mode loader for libdt_cli_wrapper.so.
+Same dt_cli_process_simple()/dt_cli_process_many() as the
+_dt_cli_wrapper extension built by build_wrapper.py, but dlopen()ed at
+import time - no C compiler or build step, only the library from
+build_cli_lib.sh.
+"""
+
+import os
+
+from cffi import FFI
+
+ffi = FFI()
+
+# Keep in sync with build_wrapper.py
+ffi.cdef("""
+    int dt_cli_process_simple(const char *input_path,
+                              const char *output_path,
+                              int width,
+                              int height);
+    int dt_cli_process_many(const char *const *inputs,
+                            const char *const *outputs,
+                            const int *widths,
+                            const int *heights,
+                            size_t n);
+""")
+
+# build_cli_lib.sh writes the library next to this file and bakes in the
+# rpath to libdarktable; fall back to the normal loader search path
+_LIB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "libdt_cli_wrapper.so")
+
+lib = ffi.dlopen(_LIB_PATH if os.path.exists(_LIB_PATH) else "libdt_cli_wrapper.so")
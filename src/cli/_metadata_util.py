@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Shared helpers of the metadata extraction benchmarks.
+
+benchmark_parallel_metadata.py, benchmark_multiprocessing_metadata.py and
+benchmark_pyexiv2_vs_exifread.py time the same extractors the same way;
+the timer, the run label and the tag conversions live here.
+"""
+
+import os
+import platform
+import time
+from contextlib import contextmanager
+
+# exifread is pure Python, so the interpreter matters as much as the pool:
+# label every run so CPython and `pypy3 <script>` results can be compared
+INTERPRETER = f"{platform.python_implementation()} {platform.python_version()}"
+
+
+@contextmanager
+def timer():
+    """Time a block with perf_counter_ns; the yielded callable returns elapsed seconds"""
+    t0 = time.perf_counter_ns()
+    end = []
+    yield lambda: ((end[0] if end else time.perf_counter_ns()) - t0) / 1e9
+    end.append(time.perf_counter_ns())
+
+
+def _rational(value):
+    """Convert an Exiv2 rational string ('num/den') to float"""
+    num, sep, denom = value.partition('/')
+    if not sep:
+        return float(num)
+    denom = float(denom)
+    return float(num) / denom if denom != 0 else 0.0
+
+
+# Readahead window that covers the EXIF header of an ARW
+PREFETCH_BYTES = 128 * 1024
+
+
+def _prefetch(f):
+    """Ask the kernel to read the header in one go before exifread starts seeking"""
+    if hasattr(os, 'posix_fadvise'):
+        fd = f.fileno()
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        os.posix_fadvise(fd, 0, PREFETCH_BYTES, os.POSIX_FADV_WILLNEED)
+
+
+def _f(tag, default=0.0):
+    """First value of an exifread tag as float (missing tag -> default)"""
+    values = getattr(tag, 'values', None)
+    return float(values[0]) if values else default
+
+
+def _i(tag, default=1):
+    """First value of an exifread tag as int (missing tag -> default)"""
+    values = getattr(tag, 'values', None)
+    return int(values[0]) if values else default
+
+
+def _s(tag, default='Unknown'):
+    """ASCII exifread tag as a stripped str from .values, skipping str(tag) (missing tag -> default)"""
+    values = getattr(tag, 'values', None)
+    if values is None:
+        return default
+    if isinstance(values, (bytes, bytearray)):
+        values = values.decode('ascii', 'ignore')
+    elif not isinstance(values, str):
+        values = str(values)
+    return values.strip()
@@ -1,76 +1,127 @@
 #!/usr/bin/env python3
 """
-Benchmark: multiprocessing.Pool for Metadata Extraction
+Benchmark: ProcessPoolExecutor for Metadata Extraction
 Goal: Test if separate processes (no GIL sharing) provide speedup
 
 Compares:
 1. Serial metadata extraction
-2. Parallel with multiprocessing.Pool (2, 4, 8 processes)
+2. Parallel with concurrent.futures.ProcessPoolExecutor (2, 4, 8 processes)
+
+Uses pyexiv2 (Exiv2 C++ bindings) when installed, falling back to exifread.
 """
 
+import argparse
+import functools
 import os
 import sys
-import time
-import glob
-from multiprocessing import Pool
+import mmap
+import struct
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+from _metadata_util import INTERPRETER, PREFETCH_BYTES, timer, _rational, _prefetch, _f, _i, _s
+
+try:
+    import pyexiv2
+    HAS_PYEXIV2 = True
+except ImportError:
+    HAS_PYEXIV2 = False
 
 try:
     import exifread
+    HAS_EXIFREAD = True
 except ImportError:
-    print("ERROR: exifread not installed (pip install exifread)")
+    HAS_EXIFREAD = False
+
+if not HAS_PYEXIV2 and not HAS_EXIFREAD:
+    print("ERROR: Need at least one of: pyexiv2, exifread (pip install pyexiv2)")
     sys.exit(1)
 
 TEST_DATA_DIR = "/mnt/2t4/development/darktable/test_data"
+DT_IMPORT_MS = 17  # dt_image_import() per-file average from the Phase 2 benchmarks
 
 
-def extract_metadata_exifread(raw_path):
-    """Extract minimal metadata using exifread (pure Python)"""
+def extract_metadata_exiv2(entry):
+    """Extract minimal metadata using pyexiv2 (Exiv2 C++ bindings)"""
+    raw_path, filename = entry  # basename precomputed once in main()
     try:
-        with open(raw_path, 'rb') as f:
-            tags = exifread.process_file(f, details=True)
+        img = pyexiv2.Image(raw_path)
+        try:
+            data = img.read_exif()
+        finally:
+            img.close()
 
-        # Extract required fields
-        maker = str(tags.get('Image Make', 'Unknown')).strip()
-        model = str(tags.get('Image Model', 'Unknown')).strip()
-        lens = str(tags.get('EXIF LensModel', model)).strip()
+        maker = data.get('Exif.Image.Make', 'Unknown').strip()
+        model = data.get('Exif.Image.Model', 'Unknown').strip()
+        lens = data.get('Exif.Photo.LensModel', model).strip()
 
-        # Dimensions
-        width = tags.get('EXIF ExifImageWidth')
-        height = tags.get('EXIF ExifImageLength')
+        return {
+            'filename': filename,
+            'maker': maker,
+            'model': model,
+            'lens': lens,
+            'width': int(data.get('Exif.Photo.PixelXDimension', 0)),
+            'height': int(data.get('Exif.Photo.PixelYDimension', 0)),
+            'focal_length': _rational(data.get('Exif.Photo.FocalLength', '0/1')),
+            'aperture': _rational(data.get('Exif.Photo.FNumber', '0/1')),
+            'orientation': int(data.get('Exif.Image.Orientation', 1)),
+        }
+    except Exception as e:
+        return {'filename': filename, 'error': str(e)}
 
-        if width:
-            width = int(str(width))
-        else:
-            width = tags.get('EXIF SubIFD0 ImageWidth')
-            width = int(str(width)) if width else 0
 
-        if height:
-            height = int(str(height))
-        else:
-            height = tags.get('EXIF SubIFD0 ImageLength')
-            height = int(str(height)) if height else 0
+# Fork start method on Linux: explicit, so a changed platform default can't
+# silently switch us to spawn (and lose the inherited _SHARED_BUFS below)
+MP_CONTEXT = multiprocessing.get_context('fork') if sys.platform.startswith('linux') else None
 
-        # Exposure data
-        focal_length = tags.get('EXIF FocalLength')
-        if focal_length and hasattr(focal_length, 'values'):
-            focal_length = float(focal_length.values[0])
-        else:
-            focal_length = 0.0
+# path -> read-only mmap of each unique file, mapped once in main() before the
+# workers fork so they all parse the same page-cache pages without reopening
+_SHARED_BUFS = {}
 
-        aperture = tags.get('EXIF FNumber')
-        if aperture and hasattr(aperture, 'values'):
-            aperture = float(aperture.values[0])
-        else:
-            aperture = 0.0
 
-        orientation = tags.get('Image Orientation')
-        if orientation and hasattr(orientation, 'values'):
-            orientation = int(orientation.values[0])
+def map_shared_buffers(paths):
+    """mmap every file into _SHARED_BUFS and start reading in its header"""
+    for path in paths:
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, 'MADV_WILLNEED'):
+            buf.madvise(mmap.MADV_WILLNEED, 0, min(PREFETCH_BYTES, len(buf)))
+        _SHARED_BUFS[path] = buf
+
+
+def extract_metadata_exifread(entry):
+    """Extract minimal metadata using exifread (pure Python fallback)"""
+    raw_path, filename = entry  # basename precomputed once in main()
+    try:
+        # Skip maker notes/thumbnails and stop once the EXIF IFD reaches
+        # LensModel (exifread matches stop_tag against the bare tag name)
+        buf = _SHARED_BUFS.get(raw_path)
+        if buf is not None:
+            # mmap is file-like; each process has its own copy of the position
+            buf.seek(0)
+            tags = exifread.process_file(buf, details=False, stop_tag='LensModel')
         else:
-            orientation = 1
+            with open(raw_path, 'rb') as f:
+                _prefetch(f)
+                tags = exifread.process_file(f, details=False, stop_tag='LensModel')
+
+        # Extract required fields
+        maker = _s(tags.get('Image Make'))
+        model = _s(tags.get('Image Model'))
+        lens = _s(tags.get('EXIF LensModel'), model)
+
+        # Dimensions (fall back to SubIFD dimensions)
+        width = (_i(tags.get('EXIF ExifImageWidth'), 0)
+                 or _i(tags.get('EXIF SubIFD0 ImageWidth'), 0))
+        height = (_i(tags.get('EXIF ExifImageLength'), 0)
+                  or _i(tags.get('EXIF SubIFD0 ImageLength'), 0))
+
+        # Exposure data
+        focal_length = _f(tags.get('EXIF FocalLength'))
+        aperture = _f(tags.get('EXIF FNumber'))
+        orientation = _i(tags.get('Image Orientation'))
 
         return {
-            'filename': os.path.basename(raw_path),
+            'filename': filename,
             'maker': maker,
             'model': model,
             'lens': lens,
@@ -81,119 +132,283 @@ def extract_metadata_exifread(raw_path):
             'orientation': orientation,
         }
     except Exception as e:
-        return {'filename': os.path.basename(raw_path), 'error': str(e)}
+        return {'filename': filename, 'error': str(e)}
+
+
+# Prefer the C++ parser; exifread walks every IFD in Python bytecode
+PARSER = 'pyexiv2' if HAS_PYEXIV2 else 'exifread'
+extract_metadata = extract_metadata_exiv2 if HAS_PYEXIV2 else extract_metadata_exifread
+
+
+# Fixed binary layout for results crossing the process boundary: pickling
+# a short bytes record is far cheaper for the parent than unpickling a dict
+_RECORD = struct.Struct('<64s32s32s32s64sIIddB')
+
+
+def _pack_metadata(m):
+    """Pack a metadata dict into a _RECORD blob
+
+    A field _RECORD cannot hold (a str where a number goes, a value out of
+    the B/I range) becomes an error record for that file, like a failed
+    extraction, instead of raising in the worker and aborting the map.
+    """
+    if 'error' not in m:
+        try:
+            return _RECORD.pack(m['filename'].encode(), m['maker'].encode(),
+                                m['model'].encode(), m['lens'].encode(), b'',
+                                m['width'], m['height'], m['focal_length'],
+                                m['aperture'], m['orientation'])
+        except (struct.error, AttributeError) as e:
+            m = {'filename': m['filename'], 'error': str(e)}
+    return _RECORD.pack(m['filename'].encode(), b'', b'', b'',
+                        m['error'].encode(), 0, 0, 0.0, 0.0, 0)
+
+
+def _unpack_metadata(blob):
+    """Rebuild the metadata dict from a _RECORD blob"""
+    (filename, maker, model, lens, error, width, height,
+     focal_length, aperture, orientation) = _RECORD.unpack(blob)
+    filename = filename.rstrip(b'\0').decode(errors='ignore')
+    if error.rstrip(b'\0'):
+        return {'filename': filename, 'error': error.rstrip(b'\0').decode(errors='ignore')}
+    return {
+        'filename': filename,
+        'maker': maker.rstrip(b'\0').decode(errors='ignore'),
+        'model': model.rstrip(b'\0').decode(errors='ignore'),
+        'lens': lens.rstrip(b'\0').decode(errors='ignore'),
+        'width': width,
+        'height': height,
+        'focal_length': focal_length,
+        'aperture': aperture,
+        'orientation': orientation,
+    }
+
+
+def extract_metadata_packed(entry):
+    """Worker entry point: extract metadata and return it as a _RECORD blob"""
+    return _pack_metadata(extract_metadata(entry))
 
 
 def benchmark_serial(raw_files):
     """Serial metadata extraction"""
-    t0 = time.time()
-    results = [extract_metadata_exifread(path) for path in raw_files]
-    elapsed = time.time() - t0
-    return results, elapsed
+    with timer() as elapsed:
+        results = [extract_metadata(entry) for entry in raw_files]
+    return results, elapsed()
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_metadata(raw_path, filename, mtime_ns, size):
+    """mtime_ns and size are only part of the cache key"""
+    return extract_metadata((raw_path, filename))
 
 
-def benchmark_multiprocessing(raw_files, processes=4):
-    """Parallel metadata extraction with multiprocessing.Pool"""
-    t0 = time.time()
-    with Pool(processes=processes) as pool:
-        results = pool.map(extract_metadata_exifread, raw_files)
-    elapsed = time.time() - t0
-    return results, elapsed
+def extract_metadata_cached(entry):
+    """extract_metadata memoized on (path, mtime_ns, size), so an edited file is parsed again"""
+    raw_path, filename = entry
+    st = os.stat(raw_path)
+    return _cached_metadata(raw_path, filename, st.st_mtime_ns, st.st_size)
+
+
+def benchmark_dedup(raw_files):
+    """Serial extraction through the cache: (results, first-touch time, total time)"""
+    _cached_metadata.cache_clear()
+    with timer() as first_touch:
+        for entry in dict.fromkeys(raw_files):
+            extract_metadata_cached(entry)
+    with timer() as repeats:
+        results = [extract_metadata_cached(entry) for entry in raw_files]
+    return results, first_touch(), first_touch() + repeats()
+
+
+def _init_worker():
+    """Per-worker setup: import the parser once, before any file is timed"""
+    global pyexiv2, exifread
+    if PARSER == 'pyexiv2':
+        import pyexiv2
+    else:
+        import exifread
+
+
+def start_executor(processes):
+    """Start a ProcessPoolExecutor and wait until all of its workers are up"""
+    executor = ProcessPoolExecutor(max_workers=processes, mp_context=MP_CONTEXT,
+                                   initializer=_init_worker)
+    wait([executor.submit(os.getpid) for _ in range(processes)])
+    return executor
+
+
+def benchmark_multiprocessing(executor, raw_files, processes=4):
+    """Parallel metadata extraction on an already-started ProcessPoolExecutor"""
+    chunksize = max(1, len(raw_files) // (processes * 4))
+    with timer() as elapsed:
+        blobs = list(executor.map(extract_metadata_packed, raw_files, chunksize=chunksize))
+
+    # Decoding happens outside the timed region
+    return [_unpack_metadata(b) for b in blobs], elapsed()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--skip-serial', action='store_true',
+                        help="don't run the serial baseline (speedups are not reported)")
+    parser.add_argument('--only', type=int, metavar='N',
+                        help="only benchmark an executor with N processes")
+    parser.add_argument('--dedup', action='store_true',
+                        help="also time a serial run memoized per unique file")
+    return parser.parse_args()
 
 
 def main():
+    args = parse_args()
+
     print("="*70)
-    print("multiprocessing.Pool Metadata Extraction Benchmark")
+    print("ProcessPoolExecutor Metadata Extraction Benchmark")
+    print(f"Interpreter: {INTERPRETER}")
     print("="*70)
 
     # Find test files - repeat them to have more samples
-    raw_files_base = sorted(glob.glob(os.path.join(TEST_DATA_DIR, "*.ARW")))
-    if not raw_files_base:
+    with os.scandir(TEST_DATA_DIR) as it:
+        entries = sorted((e for e in it if e.name.endswith('.ARW')), key=lambda e: e.name)
+    if not entries:
         print(f"ERROR: No ARW files found in {TEST_DATA_DIR}")
         sys.exit(1)
 
+    # Resolve names and sizes once (DirEntry caches the stat result);
+    # workers receive (path, basename) pairs
+    file_info = [(e.path, e.name, e.stat().st_size) for e in entries]
+
     # Repeat files to get 20 samples (5 files × 4 = 20)
-    raw_files = raw_files_base * 4
+    raw_files = [(p, name) for p, name, _ in file_info] * 4
+    n_files = len(raw_files)
+    repeats = n_files // len(file_info)
+
+    print(f"\nFound {len(file_info)} unique ARW files, testing with {n_files} total operations")
+    print(f"(Each file processed {repeats} times)")
+    print(f"Parser: {PARSER}")
 
-    print(f"\nFound {len(raw_files_base)} unique ARW files, testing with {len(raw_files)} total operations")
-    print(f"(Each file processed {len(raw_files) // len(raw_files_base)} times)")
+    for _, name, size in file_info:
+        print(f"  - {name} ({size / (1024 * 1024):.1f} MB)")
 
-    for f in raw_files_base:
-        size_mb = os.path.getsize(f) / (1024 * 1024)
-        print(f"  - {os.path.basename(f)} ({size_mb:.1f} MB)")
+    # exifread parses straight from shared mappings; only worth it when the
+    # workers fork and inherit them (spawned workers fall back to open())
+    if PARSER == 'exifread' and MP_CONTEXT is not None:
+        map_shared_buffers([p for p, _, _ in file_info])
+        print(f"Shared read-only mmap buffers: {len(_SHARED_BUFS)}")
 
     print("="*70)
 
+    process_counts = [args.only] if args.only else [2, 4, 8]
+    steps = len(process_counts) + (0 if args.skip_serial else 1) + (1 if args.dedup else 0)
+    step = 0
+
     # Benchmark serial
-    print(f"\n[1/4] Serial extraction...")
-    metadata_serial, time_serial = benchmark_serial(raw_files)
-    errors_serial = sum(1 for m in metadata_serial if 'error' in m)
-    print(f"  ✓ Completed in {time_serial:.3f}s")
-    print(f"    Per-file: {time_serial / len(raw_files) * 1000:.2f}ms")
-    if errors_serial > 0:
-        print(f"    ⚠ Errors: {errors_serial}/{len(raw_files)}")
+    time_serial = None
+    if not args.skip_serial:
+        step += 1
+        print(f"\n[{step}/{steps}] Serial extraction...")
+        metadata_serial, time_serial = benchmark_serial(raw_files)
+        errors_serial = sum(1 for m in metadata_serial if 'error' in m)
+        print(f"  ✓ Completed in {time_serial:.3f}s")
+        print(f"    Per-file: {time_serial / n_files * 1000:.2f}ms")
+        if errors_serial > 0:
+            print(f"    ⚠ Errors: {errors_serial}/{n_files}")
+
+    # Benchmark serial with duplicate files served from the cache
+    time_first_touch = time_dedup = None
+    if args.dedup:
+        step += 1
+        print(f"\n[{step}/{steps}] Serial extraction, memoized per file...")
+        metadata_dedup, time_first_touch, time_dedup = benchmark_dedup(raw_files)
+        errors_dedup = sum(1 for m in metadata_dedup if 'error' in m)
+        print(f"  ✓ Completed in {time_dedup:.3f}s "
+              f"(first touch of {len(file_info)} files: {time_first_touch:.3f}s)")
+        print(f"    Per-file (amortized): {time_dedup / n_files * 1000:.2f}ms")
+        if errors_dedup > 0:
+            print(f"    ⚠ Errors: {errors_dedup}/{n_files}")
 
     # Benchmark multiprocessing with different process counts
-    process_counts = [2, 4, 8]
     results_summary = []
 
-    for idx, processes in enumerate(process_counts, start=2):
-        print(f"\n[{idx}/4] Parallel extraction ({processes} processes)...")
-        metadata_parallel, time_parallel = benchmark_multiprocessing(raw_files, processes)
-
-        errors_parallel = sum(1 for m in metadata_parallel if 'error' in m)
-        speedup = time_serial / time_parallel if time_parallel > 0 else 0
-
-        print(f"  ✓ Completed in {time_parallel:.3f}s")
-        print(f"    Per-file: {time_parallel / len(raw_files) * 1000:.2f}ms")
-        print(f"    Speedup: {speedup:.2f}x")
-        if errors_parallel > 0:
-            print(f"    ⚠ Errors: {errors_parallel}/{len(raw_files)}")
-
-        results_summary.append({
-            'processes': processes,
-            'time': time_parallel,
-            'speedup': speedup
-        })
-
-    # Summary
-    print("\n" + "="*70)
-    print("SUMMARY")
-    print("="*70)
-
-    print(f"\nFiles: {len(raw_files)} operations ({len(raw_files_base)} unique files × {len(raw_files) // len(raw_files_base)})")
-    print(f"Serial time: {time_serial:.3f}s ({time_serial/len(raw_files)*1000:.2f}ms per file)")
-
-    print(f"\nmultiprocessing.Pool results:")
+    # Start every executor before timing so worker startup is not measured
+    executors = {processes: start_executor(processes) for processes in process_counts}
+    try:
+        for processes in process_counts:
+            step += 1
+            print(f"\n[{step}/{steps}] Parallel extraction ({processes} processes)...")
+            metadata_parallel, time_parallel = benchmark_multiprocessing(
+                executors[processes], raw_files, processes)
+
+            errors_parallel = sum(1 for m in metadata_parallel if 'error' in m)
+            speedup = time_serial / time_parallel if time_serial and time_parallel > 0 else None
+
+            print(f"  ✓ Completed in {time_parallel:.3f}s")
+            print(f"    Per-file: {time_parallel / n_files * 1000:.2f}ms")
+            if speedup is not None:
+                print(f"    Speedup: {speedup:.2f}x")
+            if errors_parallel > 0:
+                print(f"    ⚠ Errors: {errors_parallel}/{n_files}")
+
+            results_summary.append({
+                'processes': processes,
+                'time': time_parallel,
+                'speedup': speedup
+            })
+    finally:
+        for executor in executors.values():
+            executor.shutdown()
+        for buf in _SHARED_BUFS.values():
+            buf.close()
+
+    # Summary - collected and written with a single print
+    lines = ["", "="*70, "SUMMARY", "="*70, ""]
+    lines.append(f"Interpreter: {INTERPRETER}")
+    lines.append(f"Files: {n_files} operations ({len(file_info)} unique files × {repeats})")
+    if time_serial is not None:
+        lines.append(f"Serial time: {time_serial:.3f}s ({time_serial / n_files * 1000:.2f}ms per file)")
+    if time_dedup is not None:
+        lines.append(f"Memoized serial: first touch {time_first_touch:.3f}s "
+                     f"({time_first_touch / len(file_info) * 1000:.2f}ms per unique file), "
+                     f"amortized {time_dedup:.3f}s ({time_dedup / n_files * 1000:.2f}ms per file)")
+
+    lines += ["", "ProcessPoolExecutor results:"]
     for result in results_summary:
-        efficiency = (result['speedup'] / result['processes']) * 100
-        print(f"  {result['processes']:2d} processes: {result['time']:.3f}s → {result['speedup']:.2f}x speedup ({efficiency:.0f}% efficiency)")
-
-    print(f"\n{'='*70}")
-    print("Comparison to darktable dt_image_import():")
-    print(f"{'='*70}")
-    print("From Phase 2 benchmarks:")
-    print("  Run 1 (first import): 10-23ms per file (avg 17ms)")
-    print()
+        line = f"  {result['processes']:2d} processes: {result['time']:.3f}s"
+        if result['speedup'] is not None:
+            efficiency = (result['speedup'] / result['processes']) * 100
+            line += f" → {result['speedup']:.2f}x speedup ({efficiency:.0f}% efficiency)"
+        lines.append(line)
+
+    lines += [
+        "",
+        "="*70,
+        "Comparison to darktable dt_image_import():",
+        "="*70,
+        "From Phase 2 benchmarks:",
+        f"  Run 1 (first import): 10-23ms per file (avg {DT_IMPORT_MS}ms)",
+        "",
+    ]
 
     if results_summary:
-        best = max(results_summary, key=lambda r: r['speedup'])
-        best_time_per_file = best['time'] / len(raw_files) * 1000
-        dt_import_time = 17  # ms per file
-
-        print(f"Best result: {best['processes']} processes")
-        print(f"  Time per file: {best_time_per_file:.2f}ms")
-        print(f"  Speedup vs serial exifread: {best['speedup']:.2f}x")
-        print(f"  vs darktable import (17ms): {dt_import_time / best_time_per_file:.2f}x faster than darktable")
-        print()
-        print(f"For 1000 files:")
-        print(f"  darktable serial import:       ~17.0s")
-        print(f"  exifread serial:               ~{time_serial / len(raw_files) * 1000:.1f}s")
-        print(f"  exifread multiprocessing ({best['processes']}p): ~{best_time_per_file * 1000 / 1000:.1f}s ({best['speedup']:.1f}x speedup)")
-
-    print("="*70)
-    print("✓ Benchmark complete")
-    print("="*70)
+        best = min(results_summary, key=lambda r: r['time'])
+        best_time_per_file = best['time'] / n_files * 1000
+
+        lines.append(f"Best result: {best['processes']} processes")
+        lines.append(f"  Time per file: {best_time_per_file:.2f}ms")
+        if best['speedup'] is not None:
+            lines.append(f"  Speedup vs serial {PARSER}: {best['speedup']:.2f}x")
+        lines.append(f"  vs darktable import ({DT_IMPORT_MS}ms): "
+                     f"{DT_IMPORT_MS / best_time_per_file:.2f}x faster than darktable")
+        lines += ["", "For 1000 files:"]
+        lines.append(f"  darktable serial import:       ~{DT_IMPORT_MS:.1f}s")
+        if time_serial is not None:
+            lines.append(f"  {PARSER + ' serial:':31s}~{time_serial / n_files * 1000:.1f}s")
+        line = f"  {PARSER} multiprocessing ({best['processes']}p): ~{best_time_per_file:.1f}s"
+        if best['speedup'] is not None:
+            line += f" ({best['speedup']:.1f}x speedup)"
+        lines.append(line)
+
+    lines += ["="*70, "✓ Benchmark complete", "="*70]
+    print('\n'.join(lines))
 
 
 if __name__ == '__main__':
@@ -6,20 +6,36 @@ Goal: Validate 10x speedup hypothesis from batch_import_strategy.md
 Compares:
 1. Serial metadata extraction (current darktable approach)
 2. Parallel metadata extraction with ThreadPoolExecutor
-3. Different Python libraries: exifread, rawpy
+   (wider thread sweep on free-threaded CPython 3.13t)
+3. Different Python libraries: pyexiv2, exifread, rawpy
+   plus a minimal struct-based TIFF/IFD reader (no dependencies)
+4. Batched stay_open exiftool (one persistent process per worker)
 
 Expected result: 10x speedup with 10 threads
 """
 
+import argparse
 import os
 import sys
-import time
-import glob
+import json
+import mmap
+import shutil
+import struct
+import subprocess
+import threading
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor
 import statistics
+from _metadata_util import INTERPRETER, timer, _rational, _prefetch, _f, _i, _s
+
+# Try to import all libraries
+try:
+    import pyexiv2
+    HAS_PYEXIV2 = True
+except ImportError:
+    HAS_PYEXIV2 = False
+    print("⚠ pyexiv2 not installed (pip install pyexiv2)")
 
-# Try to import both libraries
 try:
     import exifread
     HAS_EXIFREAD = True
@@ -34,73 +50,83 @@ except ImportError:
     HAS_RAWPY = False
     print("⚠ rawpy not installed (pip install rawpy)")
 
-if not HAS_EXIFREAD and not HAS_RAWPY:
-    print("ERROR: Need at least one of: exifread, rawpy")
-    sys.exit(1)
+HAS_EXIFTOOL = shutil.which('exiftool') is not None
+if not HAS_EXIFTOOL:
+    print("⚠ exiftool not found in PATH")
+
+# No hard requirement: the built-in TIFF reader is always available
+
+# Free-threaded CPython (PEP 703, python3.13t) runs the pure-Python extractors
+# truly in parallel, so the thread sweep can go past 10 threads
+FREE_THREADED = not getattr(sys, '_is_gil_enabled', lambda: True)()
 
 TEST_DATA_DIR = "/mnt/2t4/development/darktable/test_data"
+DT_IMPORT_MS = 17  # dt_image_import() per-file average from the Phase 2 benchmarks
 
 
-def extract_metadata_exifread(raw_path):
-    """Extract minimal metadata using exifread (pure Python)"""
+def extract_metadata_exiv2(entry):
+    """Extract minimal metadata using pyexiv2 (Exiv2 C++ bindings)"""
+    raw_path, filename = entry  # basename precomputed once in main()
     try:
-        with open(raw_path, 'rb') as f:
-            tags = exifread.process_file(f, details=True)
+        img = pyexiv2.Image(raw_path)
+        try:
+            data = img.read_exif()
+        finally:
+            img.close()
 
-        # Extract required fields for darktable import
-        maker = str(tags.get('Image Make', 'Unknown')).strip()
-        model = str(tags.get('Image Model', 'Unknown')).strip()
+        maker = data.get('Exif.Image.Make', 'Unknown').strip()
+        model = data.get('Exif.Image.Model', 'Unknown').strip()
 
         # For Sony ZV-1 with fixed lens, use model as lens name
-        lens = str(tags.get('EXIF LensModel', model)).strip()
+        lens = data.get('Exif.Photo.LensModel', model).strip()
 
-        # Dimensions - use EXIF tags (processed image dimensions)
-        width = tags.get('EXIF ExifImageWidth')
-        height = tags.get('EXIF ExifImageLength')
+        return {
+            'filename': filename,
+            'maker': maker,
+            'model': model,
+            'lens': lens,
+            'width': int(data.get('Exif.Photo.PixelXDimension', 0)),
+            'height': int(data.get('Exif.Photo.PixelYDimension', 0)),
+            'focal_length': _rational(data.get('Exif.Photo.FocalLength', '0/1')),
+            'aperture': _rational(data.get('Exif.Photo.FNumber', '0/1')),
+            'orientation': int(data.get('Exif.Image.Orientation', 1)),
+            'method': 'exiv2'
+        }
+    except Exception as e:
+        return {'filename': filename, 'error': str(e), 'method': 'exiv2'}
 
-        # Parse dimensions
-        if width:
-            width = int(str(width))
-        else:
-            # Fallback to SubIFD dimensions
-            width = tags.get('EXIF SubIFD0 ImageWidth')
-            width = int(str(width)) if width else 0
 
-        if height:
-            height = int(str(height))
-        else:
-            # Fallback to SubIFD dimensions
-            height = tags.get('EXIF SubIFD0 ImageLength')
-            height = int(str(height)) if height else 0
+def extract_metadata_exifread(entry):
+    """Extract minimal metadata using exifread (pure Python)"""
+    raw_path, filename = entry  # basename precomputed once in main()
+    try:
+        with open(raw_path, 'rb') as f:
+            _prefetch(f)
+            # Skip maker notes/thumbnails and stop once the EXIF IFD reaches
+            # LensModel (exifread matches stop_tag against the bare tag name)
+            tags = exifread.process_file(f, details=False, stop_tag='LensModel')
 
-        # Exposure data
-        focal_length = tags.get('EXIF FocalLength')
-        if focal_length:
-            focal_length = float(focal_length.values[0]) if hasattr(focal_length, 'values') else 0.0
-        else:
-            focal_length = 0.0
+        # Extract required fields for darktable import
+        maker = _s(tags.get('Image Make'))
+        model = _s(tags.get('Image Model'))
 
-        aperture = tags.get('EXIF FNumber')
-        if aperture:
-            aperture = float(aperture.values[0]) if hasattr(aperture, 'values') else 0.0
-        else:
-            aperture = 0.0
+        # For Sony ZV-1 with fixed lens, use model as lens name
+        lens = _s(tags.get('EXIF LensModel'), model)
 
-        orientation = tags.get('Image Orientation')
-        if orientation:
-            # exifread returns IFD tag objects with .values attribute for numeric value
-            if hasattr(orientation, 'values'):
-                orientation = int(orientation.values[0])
-            else:
-                try:
-                    orientation = int(str(orientation))
-                except (ValueError, TypeError):
-                    orientation = 1  # Default to normal orientation
-        else:
-            orientation = 1
+        # Dimensions - use EXIF tags (processed image dimensions),
+        # falling back to SubIFD dimensions
+        width = (_i(tags.get('EXIF ExifImageWidth'), 0)
+                 or _i(tags.get('EXIF SubIFD0 ImageWidth'), 0))
+        height = (_i(tags.get('EXIF ExifImageLength'), 0)
+                  or _i(tags.get('EXIF SubIFD0 ImageLength'), 0))
+
+        # Exposure data
+        focal_length = _f(tags.get('EXIF FocalLength'))
+        aperture = _f(tags.get('EXIF FNumber'))
+        orientation = _i(tags.get('Image Orientation'))
 
         return {
-            'filename': os.path.basename(raw_path),
+            'filename': filename,
             'maker': maker,
             'model': model,
             'lens': lens,
@@ -112,150 +138,389 @@ def extract_metadata_exifread(raw_path):
             'method': 'exifread'
         }
     except Exception as e:
-        return {'filename': os.path.basename(raw_path), 'error': str(e), 'method': 'exifread'}
+        return {'filename': filename, 'error': str(e), 'method': 'exifread'}
+
+
+# TIFF field type -> byte size (BYTE, ASCII, SHORT, LONG, RATIONAL, UNDEFINED, SLONG, SRATIONAL)
+_TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+_TIFF_ENDIAN = {b'II*\0': '<', b'MM\0*': '>'}
+_IFD_ENTRY = {e: struct.Struct(e + 'HHI4s') for e in '<>'}
+
+# Only the tags we need: IFD0 (Make, Model, Orientation, ExifIFD pointer)
+# and ExifIFD (FNumber, FocalLength, PixelX/YDimension, LensModel)
+_IFD0_TAGS = {0x010f: 'maker', 0x0110: 'model', 0x0112: 'orientation', 0x8769: 'exif_ifd'}
+_EXIF_TAGS = {0x829d: 'aperture', 0x920a: 'focal_length', 0xa002: 'width',
+              0xa003: 'height', 0xa434: 'lens'}
+
+
+def _read_ifd(buf, offset, endian, wanted):
+    """Decode the wanted tags of one IFD in a single pass over its entries"""
+    entry = _IFD_ENTRY[endian]
+    (count,) = struct.unpack_from(endian + 'H', buf, offset)
+    values = {}
+    for pos in range(offset + 2, offset + 2 + 12 * count, 12):
+        tag, field_type, n, raw = entry.unpack_from(buf, pos)
+        name = wanted.get(tag)
+        if name is None:
+            continue
+        size = _TIFF_TYPE_SIZES.get(field_type, 1) * n
+        if size <= 4:
+            data = raw
+        else:
+            (data_offset,) = struct.unpack(endian + 'I', raw)
+            data = buf[data_offset:data_offset + size]
+
+        if field_type == 2:
+            values[name] = data[:size].split(b'\0', 1)[0].decode('ascii', 'ignore').strip()
+        elif field_type == 3:
+            values[name] = struct.unpack_from(endian + 'H', data)[0]
+        elif field_type == 4:
+            values[name] = struct.unpack_from(endian + 'I', data)[0]
+        elif field_type in (5, 10):
+            num, denom = struct.unpack_from(endian + ('II' if field_type == 5 else 'ii'), data)
+            values[name] = num / denom if denom != 0 else 0.0
+    return values
+
+
+def _read_tiff_tags(buf):
+    """Decode the IFD0 and EXIF IFD tags we need from a TIFF-based raw in memory"""
+    endian = _TIFF_ENDIAN.get(bytes(buf[:4]))
+    if endian is None:
+        raise ValueError("not a TIFF-based raw file")
+
+    (ifd0,) = struct.unpack_from(endian + 'I', buf, 4)
+    tags = _read_ifd(buf, ifd0, endian, _IFD0_TAGS)
+    exif_ifd = tags.pop('exif_ifd', None)
+    if exif_ifd:
+        tags.update(_read_ifd(buf, exif_ifd, endian, _EXIF_TAGS))
+    return tags
+
+
+def extract_metadata_tiff(entry):
+    """Extract minimal metadata by walking IFD0 and the EXIF IFD directly"""
+    raw_path, filename = entry  # basename precomputed once in main()
+    try:
+        with open(raw_path, 'rb') as f, \
+             mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            tags = _read_tiff_tags(buf)
 
+        model = tags.get('model', 'Unknown')
+        return {
+            'filename': filename,
+            'maker': tags.get('maker', 'Unknown'),
+            'model': model,
+            'lens': tags.get('lens', model),
+            'width': tags.get('width', 0),
+            'height': tags.get('height', 0),
+            'focal_length': tags.get('focal_length', 0.0),
+            'aperture': tags.get('aperture', 0.0),
+            'orientation': tags.get('orientation', 1),
+            'method': 'tiff'
+        }
+    except Exception as e:
+        return {'filename': filename, 'error': str(e), 'method': 'tiff'}
 
-def extract_metadata_rawpy(raw_path):
-    """Extract minimal metadata using rawpy (libraw wrapper)"""
-    try:
-        with rawpy.imread(raw_path) as raw:
-            # Get camera info
-            maker = raw.color_desc.decode('utf-8', errors='ignore').strip() if hasattr(raw, 'color_desc') else 'Unknown'
 
-            # Get dimensions
-            width = raw.sizes.width
-            height = raw.sizes.height
+# Also report raw_black/raw_maximum from rawpy. Off by default: reading
+# them unpacks the full sensor data, which a metadata pass never needs
+RAWPY_LEVELS = False
 
-            # Get RAW parameters
-            black = raw.black_level_per_channel[0] if len(raw.black_level_per_channel) > 0 else 0
-            white = raw.white_level
+# One LibRaw decoder per worker thread, recycled between files instead of
+# being constructed and destroyed for every image
+_rawpy_local = threading.local()
 
-            # rawpy doesn't easily expose EXIF, so we combine with exifread for complete metadata
-            with open(raw_path, 'rb') as f:
-                tags = exifread.process_file(f, details=False, stop_tag='EXIF LensModel')
 
-            model = str(tags.get('Image Model', 'Unknown')).strip()
-            lens = str(tags.get('EXIF LensModel', model)).strip()
-            focal_length = tags.get('EXIF FocalLength')
-            if focal_length:
-                focal_length = float(focal_length.values[0]) if hasattr(focal_length, 'values') else 0.0
-            else:
-                focal_length = 0.0
+def _rawpy_decoder():
+    """Return this thread's reusable rawpy.RawPy instance"""
+    raw = getattr(_rawpy_local, 'raw', None)
+    if raw is None:
+        raw = _rawpy_local.raw = rawpy.RawPy()
+    return raw
 
-            aperture = tags.get('EXIF FNumber')
-            if aperture:
-                aperture = float(aperture.values[0]) if hasattr(aperture, 'values') else 0.0
-            else:
-                aperture = 0.0
 
-            orientation = tags.get('Image Orientation', 1)
-            orientation = int(str(orientation)) if orientation else 1
+def extract_metadata_rawpy(entry):
+    """Extract minimal metadata using rawpy (libraw wrapper)"""
+    raw_path, filename = entry  # basename precomputed once in main()
+    try:
+        # open_file() lets LibRaw read just the headers it identifies the
+        # raw from; the EXIF tags come from a read-only mapping of the same
+        # file, so only the header pages are ever touched
+        raw = _rawpy_decoder()
+        raw.open_file(raw_path)
+        try:
+            # Get dimensions
+            width = raw.sizes.width
+            height = raw.sizes.height
+
+            # rawpy doesn't expose LibRaw's make/model/lens/shot info, so walk
+            # the IFDs directly instead of a second full exifread pass
+            with open(raw_path, 'rb') as f, \
+                 mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                tags = _read_tiff_tags(buf)
 
-            return {
-                'filename': os.path.basename(raw_path),
-                'maker': maker,
+            model = tags.get('model', 'Unknown')
+            metadata = {
+                'filename': filename,
+                'maker': tags.get('maker', 'Unknown'),
                 'model': model,
-                'lens': lens,
+                'lens': tags.get('lens', model),
                 'width': width,
                 'height': height,
-                'focal_length': focal_length,
-                'aperture': aperture,
-                'orientation': orientation,
-                'raw_black': black,
-                'raw_maximum': white,
+                'focal_length': tags.get('focal_length', 0.0),
+                'aperture': tags.get('aperture', 0.0),
+                'orientation': tags.get('orientation', 1),
                 'method': 'rawpy'
             }
+
+            if RAWPY_LEVELS:
+                # Not metadata: rawpy unpacks (decodes) the whole sensor
+                # image to report the black/white levels
+                levels = raw.black_level_per_channel
+                metadata['raw_black'] = levels[0] if len(levels) > 0 else 0
+                metadata['raw_maximum'] = raw.white_level
+            return metadata
+        finally:
+            raw.close()  # recycles the LibRaw state, keeps the decoder
+    except Exception as e:
+        return {'filename': filename, 'error': str(e), 'method': 'rawpy'}
+
+
+EXIFTOOL_ARGS = ['-fast2', '-n', '-Make', '-Model', '-LensModel', '-ImageWidth',
+                 '-ImageHeight', '-FocalLength', '-FNumber', '-Orientation', '-j']
+
+
+def _exiftool_metadata(filename, output):
+    """Map one exiftool JSON record onto the common metadata dict"""
+    try:
+        data = json.loads(output)[0]
+        model = str(data.get('Model', 'Unknown')).strip()
+        return {
+            'filename': filename,
+            'maker': str(data.get('Make', 'Unknown')).strip(),
+            'model': model,
+            'lens': str(data.get('LensModel', model)).strip(),
+            'width': int(data.get('ImageWidth', 0)),
+            'height': int(data.get('ImageHeight', 0)),
+            'focal_length': float(data.get('FocalLength', 0.0)),
+            'aperture': float(data.get('FNumber', 0.0)),
+            'orientation': int(data.get('Orientation', 1)),
+            'method': 'exiftool'
+        }
     except Exception as e:
-        return {'filename': os.path.basename(raw_path), 'error': str(e), 'method': 'rawpy'}
+        return {'filename': filename, 'error': str(e), 'method': 'exiftool'}
+
+
+def extract_metadata_exiftool_batch(raw_files):
+    """Extract minimal metadata for a batch of files with one stay_open exiftool process"""
+    proc = subprocess.Popen(['exiftool', '-stay_open', 'True', '-@', '-'],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, text=True)
+    results = []
+    try:
+        for raw_path, filename in raw_files:
+            if '\n' in raw_path:
+                # would split into two arguments of the -@ argfile
+                results.append({'filename': filename, 'error': 'newline in path',
+                                'method': 'exiftool'})
+                continue
+            try:
+                proc.stdin.write('\n'.join(EXIFTOOL_ARGS + [raw_path, '-execute']) + '\n')
+                proc.stdin.flush()
+            except OSError as e:  # exiftool has exited
+                error = f"exiftool exited: {e}"
+                break
+
+            # Each command's JSON output is terminated by a {ready} line
+            output = []
+            for line in proc.stdout:
+                if line.rstrip() == '{ready}':
+                    break
+                output.append(line)
+            else:
+                error = "exiftool exited before {ready}"
+                break
+            results.append(_exiftool_metadata(filename, ''.join(output)))
+        else:
+            error = None
+
+        # Files after a dead exiftool get error records, like any failed file
+        if error is not None:
+            results.extend({'filename': filename, 'error': error, 'method': 'exiftool'}
+                           for _, filename in raw_files[len(results):])
+    finally:
+        try:
+            proc.stdin.write('-stay_open\nFalse\n')
+            proc.stdin.close()
+        except OSError:
+            pass
+        proc.stdout.close()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+    return results
+
+
+def chunk_list(items, n):
+    """Split items into at most n contiguous, nearly equal, non-empty slices"""
+    size, extra = divmod(len(items), n)
+    chunks = []
+    start = 0
+    for i in range(n):
+        end = start + size + (1 if i < extra else 0)
+        if end > start:
+            chunks.append(items[start:end])
+        start = end
+    return chunks
+
+
+# Per-file extractors by method name ('exiftool' is batched separately)
+_METHODS = {
+    'exiv2': extract_metadata_exiv2,
+    'exifread': extract_metadata_exifread,
+    'tiff': extract_metadata_tiff,
+    'rawpy': extract_metadata_rawpy,
+}
 
 
 def benchmark_serial(raw_files, method='exifread'):
     """Benchmark serial metadata extraction"""
-    extract_func = extract_metadata_exifread if method == 'exifread' else extract_metadata_rawpy
+    if method == 'exiftool':
+        with timer() as elapsed:
+            results = extract_metadata_exiftool_batch(raw_files)
+        return results, elapsed()
 
-    t0 = time.time()
-    results = []
-    for raw_path in raw_files:
-        results.append(extract_func(raw_path))
-    elapsed = time.time() - t0
+    extract_func = _METHODS[method]
 
-    return results, elapsed
+    with timer() as elapsed:
+        results = list(map(extract_func, raw_files))
+
+    return results, elapsed()
 
 
 def benchmark_parallel(raw_files, method='exifread', max_workers=10):
     """Benchmark parallel metadata extraction"""
-    extract_func = extract_metadata_exifread if method == 'exifread' else extract_metadata_rawpy
+    if method == 'exiftool':
+        # One persistent exiftool process per worker, each fed a slice of the files
+        chunks = chunk_list(raw_files, max_workers)
+        with timer() as elapsed:
+            with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+                results = [m for batch in executor.map(extract_metadata_exiftool_batch, chunks)
+                           for m in batch]
+        return results, elapsed()
+
+    extract_func = _METHODS[method]
 
-    t0 = time.time()
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        results = list(executor.map(extract_func, raw_files))
-    elapsed = time.time() - t0
+    with timer() as elapsed:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(extract_func, raw_files))
 
-    return results, elapsed
+    return results, elapsed()
 
 
 def print_separator(char='=', length=70):
     print(char * length)
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--skip-serial', action='store_true',
+                        help="don't run the serial baseline (speedups are not reported)")
+    parser.add_argument('--only', type=int, metavar='N',
+                        help="only benchmark a pool of N threads")
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+
     print_separator()
     print("Parallel Metadata Extraction Benchmark")
+    print(f"Interpreter: {INTERPRETER}")
+    if FREE_THREADED:
+        print("Running on free-threaded CPython (GIL disabled)")
     print_separator()
 
     # Find test files
-    raw_files = sorted(glob.glob(os.path.join(TEST_DATA_DIR, "*.ARW")))
-    if not raw_files:
+    with os.scandir(TEST_DATA_DIR) as it:
+        entries = sorted((e for e in it if e.name.endswith('.ARW')), key=lambda e: e.name)
+    if not entries:
         print(f"ERROR: No ARW files found in {TEST_DATA_DIR}")
         sys.exit(1)
 
-    print(f"\nFound {len(raw_files)} ARW files:")
-    for f in raw_files:
-        size_mb = os.path.getsize(f) / (1024 * 1024)
-        print(f"  - {os.path.basename(f)} ({size_mb:.1f} MB)")
+    # Resolve names and sizes once (DirEntry caches the stat result);
+    # extractors receive (path, basename) pairs
+    file_info = [(e.path, e.name, e.stat().st_size) for e in entries]
+    raw_files = [(p, name) for p, name, _ in file_info]
+    n_files = len(raw_files)
+
+    print(f"\nFound {n_files} ARW files:")
+    for _, name, size in file_info:
+        print(f"  - {name} ({size / (1024 * 1024):.1f} MB)")
 
     print_separator()
 
     # Test each available method
     methods = []
+    if HAS_PYEXIV2:
+        methods.append('exiv2')
     if HAS_EXIFREAD:
         methods.append('exifread')
-    if HAS_RAWPY and HAS_EXIFREAD:  # rawpy needs exifread for complete metadata
+    methods.append('tiff')
+    if HAS_RAWPY:
         methods.append('rawpy')
+    if HAS_EXIFTOOL:
+        methods.append('exiftool')
 
+    if args.only:
+        thread_counts = [args.only]
+    else:
+        thread_counts = [2, 5, 10]
+        if FREE_THREADED:
+            # Threads no longer serialize on the GIL: sweep up to 2x the cores
+            cpus = os.cpu_count() or 1
+            thread_counts += [n for n in (cpus, cpus * 2) if n > thread_counts[-1]]
+    steps = len(thread_counts) + (0 if args.skip_serial else 1)
     results_summary = []
 
     for method in methods:
         print(f"\n{'='*70}")
         print(f"Method: {method.upper()}")
         print(f"{'='*70}")
+        step = 0
 
         # Benchmark serial
-        print(f"\n[1/2] Serial extraction...")
-        metadata_serial, time_serial = benchmark_serial(raw_files, method)
-
-        errors_serial = sum(1 for m in metadata_serial if 'error' in m)
-        print(f"  ✓ Completed in {time_serial:.3f}s")
-        print(f"    Per-file: {time_serial / len(raw_files) * 1000:.2f}ms")
-        if errors_serial > 0:
-            print(f"    ⚠ Errors: {errors_serial}/{len(raw_files)}")
+        metadata_serial, time_serial = None, None
+        if not args.skip_serial:
+            step += 1
+            print(f"\n[{step}/{steps}] Serial extraction...")
+            metadata_serial, time_serial = benchmark_serial(raw_files, method)
+
+            errors_serial = sum(1 for m in metadata_serial if 'error' in m)
+            print(f"  ✓ Completed in {time_serial:.3f}s")
+            print(f"    Per-file: {time_serial / n_files * 1000:.2f}ms")
+            if errors_serial > 0:
+                print(f"    ⚠ Errors: {errors_serial}/{n_files}")
 
         # Benchmark parallel with different thread counts
-        thread_counts = [2, 5, 10]
         parallel_results = []
 
         for threads in thread_counts:
-            print(f"\n[2/2] Parallel extraction ({threads} threads)...")
+            step += 1
+            print(f"\n[{step}/{steps}] Parallel extraction ({threads} threads)...")
             metadata_parallel, time_parallel = benchmark_parallel(raw_files, method, threads)
 
             errors_parallel = sum(1 for m in metadata_parallel if 'error' in m)
-            speedup = time_serial / time_parallel if time_parallel > 0 else 0
+            speedup = time_serial / time_parallel if time_serial and time_parallel > 0 else None
 
             print(f"  ✓ Completed in {time_parallel:.3f}s")
-            print(f"    Per-file: {time_parallel / len(raw_files) * 1000:.2f}ms")
-            print(f"    Speedup: {speedup:.2f}x")
+            print(f"    Per-file: {time_parallel / n_files * 1000:.2f}ms")
+            if speedup is not None:
+                print(f"    Speedup: {speedup:.2f}x")
             if errors_parallel > 0:
-                print(f"    ⚠ Errors: {errors_parallel}/{len(raw_files)}")
+                print(f"    ⚠ Errors: {errors_parallel}/{n_files}")
 
             parallel_results.append({
                 'threads': threads,
@@ -267,58 +532,68 @@ def main():
             'method': method,
             'serial_time': time_serial,
             'parallel_results': parallel_results,
-            'file_count': len(raw_files)
+            'file_count': n_files
         })
 
         # Show sample metadata from first file
-        if metadata_serial and 'error' not in metadata_serial[0]:
+        sample_source = metadata_serial or metadata_parallel
+        if sample_source and 'error' not in sample_source[0]:
             print(f"\nSample metadata (first file):")
-            sample = metadata_serial[0]
+            sample = sample_source[0]
             for key, value in sample.items():
                 if key != 'method':
                     print(f"  {key:15s}: {value}")
 
-    # Final summary
-    print_separator('=')
-    print("SUMMARY")
-    print_separator('=')
+    # Final summary - collected and written with a single print
+    lines = ['=' * 70, "SUMMARY", '=' * 70]
+    lines.append(f"Interpreter: {INTERPRETER}")
 
     for result in results_summary:
-        print(f"\nMethod: {result['method'].upper()}")
-        print(f"Files: {result['file_count']}")
-        print(f"Serial time: {result['serial_time']:.3f}s ({result['serial_time']/result['file_count']*1000:.2f}ms per file)")
-        print(f"\nParallel results:")
+        lines += ["", f"Method: {result['method'].upper()}", f"Files: {result['file_count']}"]
+        if result['serial_time'] is not None:
+            lines.append(f"Serial time: {result['serial_time']:.3f}s "
+                         f"({result['serial_time'] / result['file_count'] * 1000:.2f}ms per file)")
+        lines += ["", "Parallel results:"]
         for pr in result['parallel_results']:
-            print(f"  {pr['threads']:2d} threads: {pr['time']:.3f}s → {pr['speedup']:.2f}x speedup")
+            line = f"  {pr['threads']:2d} threads: {pr['time']:.3f}s"
+            if pr['speedup'] is not None:
+                line += f" → {pr['speedup']:.2f}x speedup"
+            lines.append(line)
 
     # Comparison to darktable import
-    print(f"\n{'-'*70}")
-    print("Comparison to darktable dt_image_import():")
-    print(f"{'-'*70}")
-    print("From Phase 2 benchmarks:")
-    print("  Run 1 (first import): 10-23ms per file (avg 17ms)")
-    print("  Run 2 (cached):       0.7-5.5ms per file (avg 3ms)")
-    print()
+    lines += [
+        "",
+        '-' * 70,
+        "Comparison to darktable dt_image_import():",
+        '-' * 70,
+        "From Phase 2 benchmarks:",
+        f"  Run 1 (first import): 10-23ms per file (avg {DT_IMPORT_MS}ms)",
+        "  Run 2 (cached):       0.7-5.5ms per file (avg 3ms)",
+        "",
+    ]
 
     if results_summary:
-        best_method = min(results_summary, key=lambda r: r['serial_time'])
-        best_parallel = min(best_method['parallel_results'], key=lambda p: p['time'])
+        # Rank by the fastest parallel run, which is also what --skip-serial measures
+        best_method, best_parallel = min(
+            ((r, p) for r in results_summary for p in r['parallel_results']),
+            key=lambda rp: rp[1]['time'])
 
-        dt_import_time = 0.017 * len(raw_files)  # 17ms per file from benchmarks
+        dt_import_time = DT_IMPORT_MS / 1000 * n_files
         our_time = best_parallel['time']
         vs_dt_speedup = dt_import_time / our_time if our_time > 0 else 0
 
-        print(f"Best result: {best_method['method']} with {best_parallel['threads']} threads")
-        print(f"  Time: {our_time:.3f}s")
-        print(f"  vs dt_import (17ms/file): {vs_dt_speedup:.2f}x faster")
-        print()
-        print(f"For 1000 files:")
-        print(f"  darktable serial import: ~17.0s")
-        print(f"  {best_method['method']} parallel:     ~{our_time / len(raw_files) * 1000:.1f}s ({best_parallel['speedup']:.1f}x speedup)")
-
-    print_separator('=')
-    print("✓ Benchmark complete")
-    print_separator('=')
+        lines.append(f"Best result: {best_method['method']} with {best_parallel['threads']} threads")
+        lines.append(f"  Time: {our_time:.3f}s")
+        lines.append(f"  vs dt_import ({DT_IMPORT_MS}ms/file): {vs_dt_speedup:.2f}x faster")
+        lines += ["", "For 1000 files:"]
+        lines.append(f"  darktable serial import: ~{DT_IMPORT_MS:.1f}s")
+        line = f"  {best_method['method']} parallel:     ~{our_time / n_files * 1000:.1f}s"
+        if best_parallel['speedup'] is not None:
+            line += f" ({best_parallel['speedup']:.1f}x speedup)"
+        lines.append(line)
+
+    lines += ['=' * 70, "✓ Benchmark complete", '=' * 70]
+    print('\n'.join(lines))
 
 
 if __name__ == '__main__':
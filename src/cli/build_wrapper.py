@@ -1,19 +1,26 @@
 #!/usr/bin/env python3
 """
 Phase 1 cffi wrapper for darktable-cli.
-Wraps dt_cli_process_simple() for Python access.
+Wraps dt_cli_process_simple() and dt_cli_process_many() for Python access.
+
+_dt_cli_abi.py loads the same function in ABI mode without this build step.
 """
 
 from cffi import FFI
 
 ffibuilder = FFI()
 
-# Define the C function signature
+# Define the C function signatures
 ffibuilder.cdef("""
     int dt_cli_process_simple(const char *input_path,
                               const char *output_path,
                               int width,
                               int height);
+    int dt_cli_process_many(const char *const *inputs,
+                            const char *const *outputs,
+                            const int *widths,
+                            const int *heights,
+                            size_t n);
 """)
 
 # Set up the source - link against our wrapper library
@@ -25,6 +32,11 @@ ffibuilder.set_source(
                                      const char *output_path,
                                      int width,
                                      int height);
+    extern int dt_cli_process_many(const char *const *inputs,
+                                   const char *const *outputs,
+                                   const int *widths,
+                                   const int *heights,
+                                   size_t n);
     """,
     libraries=['dt_cli_wrapper', 'darktable'],
     library_dirs=[
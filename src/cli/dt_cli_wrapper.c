@@ -1,6 +1,7 @@
 /*
     Phase 1 cffi wrapper library for darktable-cli.
-    Provides dt_cli_process_simple() without requiring main.c compilation.
+    Provides dt_cli_process_simple() and its batch variant
+    dt_cli_process_many() without requiring main.c compilation.
 */
 
 #include "common/darktable.h"
@@ -112,3 +113,101 @@ int dt_cli_process_simple(const char *input_path, const char *output_path, int w
 
   return (export_result == 0) ? 0 : 6;
 }
+
+// Batch variant: n images in one call, sharing one dt_init()/dt_cleanup() and
+// one set of export modules instead of a full cycle per image.
+// Returns the number of images that failed, or -1 if darktable or the export
+// modules could not be set up.
+int dt_cli_process_many(const char *const *inputs, const char *const *outputs,
+                        const int *widths, const int *heights, size_t n)
+{
+  // Minimal init args for darktable
+  char *init_argv[] = { "darktable-cli", "--library", ":memory:",
+                        "--conf", "write_sidecar_files=never", NULL };
+  int init_argc = 5;
+
+  if(dt_init(init_argc, init_argv, FALSE, TRUE, NULL, "/home/glen/Applications/Darktable/bin"))
+  {
+    fprintf(stderr, "dt_cli_process_many: failed to initialize darktable\n");
+    return -1;
+  }
+
+  // Setup export modules once (default to JPEG)
+  dt_imageio_module_format_t *format = dt_imageio_get_format_by_name("jpeg");
+  dt_imageio_module_storage_t *storage = dt_imageio_get_storage_by_name("disk");
+
+  if(!format || !storage)
+  {
+    fprintf(stderr, "dt_cli_process_many: failed to get format/storage modules\n");
+    dt_cleanup();
+    return -1;
+  }
+
+  dt_imageio_module_data_t *sdata = storage->get_params(storage);
+  dt_imageio_module_data_t *fdata = format->get_params(format);
+
+  if(!sdata || !fdata)
+  {
+    fprintf(stderr, "dt_cli_process_many: failed to get module params\n");
+    if(sdata) storage->free_params(storage, sdata);
+    if(fdata) format->free_params(format, fdata);
+    dt_cleanup();
+    return -1;
+  }
+
+  dt_export_metadata_t metadata;
+  metadata.flags = dt_lib_export_metadata_default_flags();
+  metadata.list = NULL;
+
+  int failures = 0;
+  for(size_t i = 0; i < n; i++)
+  {
+    // Import the image
+    gchar *directory = g_path_get_dirname(inputs[i]);
+    dt_film_t film;
+    dt_filmid_t filmid = dt_film_new(&film, directory);
+    g_free(directory);
+
+    if(!dt_is_valid_filmid(filmid))
+    {
+      fprintf(stderr, "dt_cli_process_many: failed to create film for %s\n", inputs[i]);
+      failures++;
+      continue;
+    }
+
+    const dt_imgid_t imgid = dt_image_import(filmid, inputs[i], TRUE, TRUE);
+    if(!dt_is_valid_imgid(imgid))
+    {
+      fprintf(stderr, "dt_cli_process_many: failed to import %s\n", inputs[i]);
+      failures++;
+      continue;
+    }
+
+    // Configure output
+    gchar *output_without_ext = g_strdup(outputs[i]);
+    gchar *last_dot = strrchr(output_without_ext, '.');
+    if(last_dot) *last_dot = '\0';
+    g_strlcpy((char *)sdata, output_without_ext, DT_MAX_PATH_FOR_PARAMS);
+    g_free(output_without_ext);
+
+    fdata->max_width = widths[i];
+    fdata->max_height = heights[i];
+
+    // Export the image
+    if(storage->store(storage, sdata, imgid, format, fdata, (int)i + 1, (int)n, TRUE, FALSE,
+                      FALSE, 1.0, FALSE, DT_COLORSPACE_SRGB, NULL,
+                      DT_INTENT_PERCEPTUAL, &metadata) != 0)
+    {
+      fprintf(stderr, "dt_cli_process_many: export failed for %s\n", inputs[i]);
+      failures++;
+    }
+  }
+
+  // Cleanup
+  if(storage->finalize_store) storage->finalize_store(storage, sdata);
+  storage->free_params(storage, sdata);
+  format->free_params(format, fdata);
+  dt_cleanup();
+
+  return failures;
+}
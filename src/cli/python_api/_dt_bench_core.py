@@ -0,0 +1,546 @@
+#!/usr/bin/env python3
+"""
+Shared core of the Phase 2 detailed benchmarks.
+
+benchmark_detailed_state_reuse.py and benchmark_detailed_no_reuse.py only
+differ in where dt_init()/dt_cleanup() go; the test file list, the timed
+per-image steps and the analysis live here.
+"""
+
+import ctypes
+import ctypes.util
+import gc
+import os
+import queue
+import resource
+import statistics
+import sys
+import threading
+import time
+from _dt_api import ffi, lib
+
+# Configuration
+TEST_DATA_DIR = b"/mnt/2t4/development/darktable/test_data"
+NUM_RUNS = 3
+NUM_WARMUP = 1  # untimed iterations before the timed runs (0 to disable)
+# Page cache state of the input raws while 'import' is timed:
+#   'warm' - read ahead once (POSIX_FADV_WILLNEED) before the timed runs
+#   'cold' - dropped (POSIX_FADV_DONTNEED) before every image
+INPUT_CACHE = 'warm'
+# Exports go to tmpfs (/dev/shm) so export_processing measures the pipeline
+# and JPEG encode, not filesystem/disk writeback; False writes under /tmp
+OUTPUT_ON_TMPFS = True
+OUTPUT_ROOT = b"/dev/shm" if OUTPUT_ON_TMPFS and os.path.isdir("/dev/shm") else b"/tmp"
+# Module lookup, module params and export config take a few µs each - about
+# the size of a timer read. With TINY_OPS_GROUP they share one timer
+# ('prep_export') instead of three.
+TINY_OPS_GROUP = True
+PREP_OPS = (['prep_export'] if TINY_OPS_GROUP
+            else ['module_lookup', 'module_params', 'configure_export'])
+# CPUs for the benchmark process, e.g. "2" or "2-3" (unset: no pinning).
+# Pinning also confines darktable's OpenMP threads to these CPUs.
+BENCH_CPU = os.environ.get('BENCH_CPU')
+OUTPUT_WIDTH = 1920
+OUTPUT_HEIGHT = 1080
+
+# dt_init() arguments, allocated once at import. dt_init() NULLs the argv
+# entries it consumes, so the pointer array is refilled before each call
+# (pointer stores only, no allocation).
+_ARGV_BUFS = [ffi.new("char[]", arg) for arg in (
+    b"darktable-benchmark",
+    b"--library", b":memory:",
+    b"--conf", b"write_sidecar_files=never",
+)]
+_ARGV_ARRAY = ffi.new("char*[]", _ARGV_BUFS)
+_BIN_PATH_BUF = ffi.new("char[]", b"/home/glen/Applications/Darktable/bin")
+_JPEG_NAME = ffi.new("char[]", b"jpeg")
+_DISK_NAME = ffi.new("char[]", b"disk")
+
+# darktable entry points bound once: every call below skips the lib
+# attribute lookup
+_dt_init = lib.dt_init
+_dt_cleanup = lib.dt_cleanup
+_film_new = lib.dt_shim_film_new
+_image_import = lib.dt_image_import
+_get_format = lib.dt_imageio_get_format_by_name
+_get_storage = lib.dt_imageio_get_storage_by_name
+_fmt_params = lib.dt_shim_format_get_params
+_stg_params = lib.dt_shim_storage_get_params
+_configure = lib.dt_shim_configure_export
+_store = lib.dt_shim_storage_store
+_finalize = lib.dt_shim_storage_finalize
+_free_fmt = lib.dt_shim_format_free_params
+_free_stg = lib.dt_shim_storage_free_params
+_valid_film = lib.dt_is_valid_filmid
+_valid_img = lib.dt_is_valid_imgid
+
+class TeeOutput:
+    """Write to both stdout and file simultaneously
+
+    Fragments are collected until a newline, then go out as one os.write()
+    to the stdout fd and one write to the report file (print() calls
+    write() separately for the text and the end).
+    """
+    def __init__(self, filename):
+        sys.stdout.flush()
+        self.terminal_fd = sys.stdout.fileno()
+        self.log = open(filename, 'w')
+        self.pending = []
+
+    def write(self, message):
+        self.pending.append(message)
+        if '\n' in message:
+            self.flush()
+        return len(message)
+
+    def flush(self):
+        if not self.pending:
+            return
+        text = ''.join(self.pending)
+        self.pending.clear()
+        data = text.encode()
+        while data:
+            data = data[os.write(self.terminal_fd, data):]
+        self.log.write(text)
+
+    def close(self):
+        self.flush()
+        self.log.close()
+
+def get_test_files():
+    """Get all ARW files and check for XMP sidecars"""
+    # One directory listing answers both questions: which raws exist (any
+    # case of the .arw suffix) and which of them have a sidecar
+    test_dir = TEST_DATA_DIR.decode()
+    with os.scandir(test_dir) as it:
+        names = {e.name for e in it}
+    arw_files = [os.path.join(test_dir, name) for name in names
+                 if name.lower().endswith(".arw")]
+
+    files = []
+    for arw in sorted(arw_files):
+        has_xmp = os.path.basename(arw) + ".xmp" in names
+        files.append({
+            'path': arw.encode(),
+            'dir': os.path.dirname(arw).encode(),  # film roll, encoded once
+            'name': os.path.basename(arw),
+            'has_xmp': has_xmp
+        })
+    return files
+
+def make_output_dir(output_dir):
+    """Create the (flat) output directory once, before anything is timed
+
+    Output paths are plain files directly in it, so the export never has
+    to create directories inside a timed region.
+    """
+    try:
+        os.mkdir(output_dir.decode())
+    except FileExistsError:
+        pass
+
+def output_paths(output_dir, test_files):
+    """Encoded output path for every (run, file), indexed [run][file]"""
+    output_dir = output_dir.decode()
+    return [[os.path.join(output_dir, f"run{r+1}_{fi['name']}.jpg").encode()
+             for fi in test_files]
+            for r in range(NUM_RUNS)]
+
+def advise_input(path, advice):
+    """posix_fadvise() a whole input file; no-op where unsupported"""
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, advice)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass  # import reports unreadable files itself
+
+def prepare_inputs(test_files):
+    """Apply INPUT_CACHE before the timed runs - return a line for the report"""
+    if INPUT_CACHE == 'cold':
+        return "Input cache: cold (dropped before every image, 'import' includes disk reads)"
+    for file_info in test_files:
+        advise_input(file_info['path'], os.POSIX_FADV_WILLNEED)
+    return "Input cache: warm (read ahead before the timed runs)"
+
+def drop_input(file_info):
+    """INPUT_CACHE == 'cold': evict one input from the page cache before it is timed"""
+    if INPUT_CACHE == 'cold':
+        advise_input(file_info['path'], os.POSIX_FADV_DONTNEED)
+
+def parse_cpu_list(spec):
+    """'0-3,6' -> {0, 1, 2, 3, 6}"""
+    cpus = set()
+    for part in spec.split(','):
+        first, _, last = part.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+def pin_process(cpus):
+    """Pin this process to cpus and raise its priority where allowed
+
+    Keeps the scheduler from migrating the timed code between cores (and
+    other work from preempting it); sub-millisecond operations are
+    otherwise dominated by that noise. Returns a line for the report.
+    """
+    notes = []
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+        notes.append(f"pinned to CPU {','.join(map(str, sorted(cpus)))}")
+    try:
+        os.nice(-5)  # needs CAP_SYS_NICE
+        notes.append("nice -5")
+    except (AttributeError, PermissionError):
+        pass
+    return ", ".join(notes) or "not pinned"
+
+def lock_memory():
+    """mlockall() so no page of this process is swapped out between timed
+    regions - return a line for the report
+
+    Only attempted when RLIMIT_MEMLOCK can't bite (unlimited, or root):
+    with MCL_FUTURE a limited process would instead see darktable's own
+    allocations fail once it reaches the limit.
+    """
+    soft, _ = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+    if soft != resource.RLIM_INFINITY and os.geteuid() != 0:
+        return "memory not locked (RLIMIT_MEMLOCK, see ulimit -l)"
+    MCL_CURRENT, MCL_FUTURE = 1, 2
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+        return f"memory not locked ({os.strerror(ctypes.get_errno())})"
+    return "memory locked"
+
+def pause_gc():
+    """Keep the cyclic GC out of the timed regions; collect_gc() at safe points"""
+    gc.collect()
+    gc.disable()
+
+def collect_gc():
+    """Run the GC passes held back by pause_gc(), outside any timed region"""
+    gc.collect()
+
+def resume_gc():
+    """Undo pause_gc()"""
+    gc.enable()
+
+def rss_kb():
+    """Resident set size of this process in kB (VmRSS), 0 where /proc is missing
+
+    Sampled once per image, outside the timed region; a leak or
+    fragmentation from repeated dt_init()/dt_cleanup() shows up as a
+    climbing RSS rather than as unexplained timing variance.
+    """
+    try:
+        with open('/proc/self/status', 'rb') as f:
+            for line in f:
+                if line.startswith(b'VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def warmup_path(output_dir):
+    """Encoded output path for untimed warmup exports (one per process)"""
+    return os.path.join(output_dir.decode(), f"warmup_{os.getpid()}.jpg").encode()
+
+def init_once():
+    """dt_init() with the benchmark arguments - return timing and success"""
+    t0 = time.perf_counter_ns()
+    _ARGV_ARRAY[0:len(_ARGV_BUFS)] = _ARGV_BUFS
+    result = _dt_init(len(_ARGV_BUFS), _ARGV_ARRAY, False, True, ffi.NULL, _BIN_PATH_BUF)
+    return {
+        'dt_init': (time.perf_counter_ns() - t0) * 1e-9,
+        'success': result == 0
+    }
+
+def cleanup_once():
+    """dt_cleanup() - return timing"""
+    t0 = time.perf_counter_ns()
+    _dt_cleanup()
+    return (time.perf_counter_ns() - t0) * 1e-9
+
+def setup_export():
+    """Look up the JPEG format / disk storage modules and allocate their params
+
+    For callers that keep darktable initialized across images: done once,
+    then passed to process_image() as export. Returns None on failure.
+    """
+    format_mod = _get_format(_JPEG_NAME)
+    storage_mod = _get_storage(_DISK_NAME)
+    if not format_mod or not storage_mod:
+        return None
+    fdata = _fmt_params(format_mod)
+    sdata = _stg_params(storage_mod)
+    if not fdata or not sdata:
+        return None
+    return format_mod, storage_mod, fdata, sdata
+
+def free_export(export):
+    """Finalize and free what setup_export() allocated"""
+    format_mod, storage_mod, fdata, sdata = export
+    _finalize(storage_mod, sdata)
+    _free_stg(storage_mod, sdata)
+    _free_fmt(format_mod, fdata)
+
+def process_image(input_path, directory, output_path, export=None):
+    """Process a single image on an initialized darktable - detailed timing
+
+    With export (from setup_export()) the modules and their params are
+    reused and only reconfigured for this image; dt_shim_configure_export()
+    overwrites the path and dimensions on every call. Without it, lookup,
+    params and their cleanup are timed per image.
+    """
+    times, imgid = import_image(input_path, directory)
+    if imgid is None:
+        return times
+    return export_image(imgid, output_path, times, export)
+
+def import_image(input_path, directory):
+    """Steps 1-2 of process_image() - return (times, imgid or None)"""
+    times = {}
+
+    # 1. Film creation
+    t0 = time.perf_counter_ns()
+    filmid = _film_new(directory)
+    times['film_new'] = (time.perf_counter_ns() - t0) * 1e-9
+
+    if not _valid_film(filmid):
+        times['success'] = False
+        return times, None
+
+    # 2. Image import (includes duplicate checking, metadata read)
+    t0 = time.perf_counter_ns()
+    imgid = _image_import(filmid, input_path, True, True)
+    times['import'] = (time.perf_counter_ns() - t0) * 1e-9
+
+    if not _valid_img(imgid):
+        times['success'] = False
+        return times, None
+
+    return times, imgid
+
+def export_image(imgid, output_path, times, export=None):
+    """Steps 3-7 of process_image() for an imported image, adding to times"""
+    if export is not None:
+        format_mod, storage_mod, fdata, sdata = export
+
+        # 5. Configure export (set paths, dimensions)
+        t0 = time.perf_counter_ns()
+        _configure(sdata, fdata, output_path, OUTPUT_WIDTH, OUTPUT_HEIGHT)
+        times['configure_export'] = (time.perf_counter_ns() - t0) * 1e-9
+    else:
+        # 3-5 are timed back to back; with TINY_OPS_GROUP only the ends are read
+        split = not TINY_OPS_GROUP
+
+        # 3. Get export modules (lookup)
+        t0 = time.perf_counter_ns()
+        format_mod = _get_format(_JPEG_NAME)
+        storage_mod = _get_storage(_DISK_NAME)
+        if split:
+            t1 = time.perf_counter_ns()
+
+        if not format_mod or not storage_mod:
+            times['success'] = False
+            return times
+
+        # 4. Get module parameters (allocate structures)
+        fdata = _fmt_params(format_mod)
+        sdata = _stg_params(storage_mod)
+        if split:
+            t2 = time.perf_counter_ns()
+
+        if not fdata or not sdata:
+            times['success'] = False
+            return times
+
+        # 5. Configure export (set paths, dimensions)
+        _configure(sdata, fdata, output_path, OUTPUT_WIDTH, OUTPUT_HEIGHT)
+        t3 = time.perf_counter_ns()
+
+        if split:
+            times['module_lookup'] = (t1 - t0) * 1e-9
+            times['module_params'] = (t2 - t1) * 1e-9
+            times['configure_export'] = (t3 - t2) * 1e-9
+        else:
+            times['prep_export'] = (t3 - t0) * 1e-9
+
+    # 6. Actual export (processing)
+    t0 = time.perf_counter_ns()
+    export_result = _store(
+        storage_mod, sdata, imgid, format_mod, fdata,
+        1, 1, True, False, False, 1, ffi.NULL, 0
+    )
+    times['export_processing'] = (time.perf_counter_ns() - t0) * 1e-9
+
+    if export is None:
+        # 7. Cleanup/finalize
+        t0 = time.perf_counter_ns()
+        free_export((format_mod, storage_mod, fdata, sdata))
+        times['export_cleanup'] = (time.perf_counter_ns() - t0) * 1e-9
+
+    times['success'] = (export_result == 0)
+    times['total'] = sum(v for k, v in times.items() if k != 'success')
+
+    return times
+
+def process_images_pipelined(jobs, export):
+    """process_image() over (file_info, output_path) jobs, importing image
+    N+1 while image N exports - return [(file_info, times)] in job order
+
+    The exports run on one background thread (the only user of export's
+    params); the _dt_api calls release the GIL, so the two overlap for real.
+    The per-operation timings are then taken under that overlap, so the
+    caller should report wall time for the batch.
+
+    This is the one place the benchmarks call into darktable from two
+    threads. It holds because each thread only ever runs one call at a
+    time and never on the same image: darktable itself imports and exports
+    from separate worker threads, and the image cache and the library
+    database (a private :memory: one here) take their own locks. What is
+    not reentrant is a single call's state - export's params - and that
+    stays on the exporter thread.
+
+    An export that raises is recorded as a failed image and the exporter
+    keeps draining, so the bounded queue never blocks the import side.
+    """
+    results = []
+    exports = queue.Queue(maxsize=1)  # bounds how far imports run ahead
+
+    def exporter():
+        while (item := exports.get()) is not None:
+            file_info, output_path, times, imgid = item
+            try:
+                if imgid is not None:
+                    times = export_image(imgid, output_path, times, export)
+                times['rss_after'] = rss_kb()
+            except Exception as e:
+                print(f"  ✗ Export error for {file_info['name']}: {e}", file=sys.stderr)
+                times['success'] = False
+            results.append((file_info, times))
+
+    thread = threading.Thread(target=exporter, daemon=True)
+    thread.start()
+    try:
+        for file_info, output_path in jobs:
+            drop_input(file_info)
+            times, imgid = import_image(file_info['path'], file_info['dir'])
+            exports.put((file_info, output_path, times, imgid))
+    finally:
+        exports.put(None)
+        thread.join()
+    return results
+
+def format_prep(times):
+    """Progress-line fragment for the export prep timing(s)"""
+    if 'prep_export' in times:
+        return f"prep={times['prep_export']:.6f}s"
+    if 'module_lookup' in times:
+        return (f"lookup={times['module_lookup']:.6f}s, params={times['module_params']:.6f}s, "
+                f"config={times['configure_export']:.6f}s")
+    return f"config={times['configure_export']:.6f}s"
+
+def timer_note():
+    """Report line: cost of one perf_counter_ns() read, the floor under every timing"""
+    deltas = []
+    for _ in range(1000):
+        t0 = time.perf_counter_ns()
+        deltas.append(time.perf_counter_ns() - t0)
+    floor = min(deltas)
+    grouping = "grouped as prep_export" if TINY_OPS_GROUP else "timed separately"
+    return f"Timer: perf_counter_ns, ~{floor}ns per read (lookup/params/config {grouping})"
+
+def csv_row(run, file_info, times, operations):
+    """CSV row for one image; only the identifying columns if it failed"""
+    row = {
+        'run': run + 1,
+        'filename': file_info['name'],
+        'has_xmp': file_info['has_xmp'],
+    }
+    if times and times['success']:
+        row.update((op, times[op]) for op in operations)
+        row['success'] = True
+    else:
+        row['success'] = False
+    if times and 'rss_after' in times:
+        row['rss_after'] = times['rss_after']
+    return row
+
+def analyze(results, operations):
+    """Per-operation mean/stdev/min/max and p50/p95/p99 - return (stats, columns)"""
+    # One pass over the results to split out the timing columns, then the
+    # summary statistics per column
+    columns = dict(zip(operations, zip(*([r[op] for op in operations] for r in results))))
+    stats = {}
+    for op, values in columns.items():
+        if len(values) > 1:
+            cuts = statistics.quantiles(values, n=100, method='inclusive')
+            p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+        else:
+            p50 = p95 = p99 = values[0]
+        stats[op] = {
+            'mean': statistics.fmean(values),
+            'stdev': statistics.stdev(values) if len(values) > 1 else 0,
+            'min': min(values),
+            'max': max(values),
+            'p50': p50,
+            'p95': p95,
+            'p99': p99
+        }
+    return stats, columns
+
+def print_stats(stats, operations):
+    """Per-image timing table, each operation as a share of 'total'"""
+    print(f"\nPer-image timing (mean ± stdev) [min - max]:")
+    for op in operations:
+        s = stats[op]
+        pct = (s['mean'] / stats['total']['mean'] * 100) if op != 'total' else 100
+        print(f"  {op:20s}: {s['mean']:.6f}s ±{s['stdev']:.6f}s  "
+              f"[{s['min']:.6f}s - {s['max']:.6f}s]  ({pct:.1f}%)")
+
+    # Tails that mean ± stdev hides (outlier images, stalls)
+    print(f"\nPer-image percentiles (p50 / p95 / p99):")
+    for op in operations:
+        s = stats[op]
+        print(f"  {op:20s}: {s['p50']:.6f}s / {s['p95']:.6f}s / {s['p99']:.6f}s")
+
+def print_xmp_effect(results, totals):
+    """Compare total time of images with and without an XMP sidecar"""
+    with_xmp, without_xmp = [], []
+    for r, total in zip(results, totals):
+        (with_xmp if r['has_xmp'] else without_xmp).append(total)
+
+    if with_xmp and without_xmp:
+        print(f"\n{'='*70}")
+        print("XMP SIDECAR EFFECT")
+        print(f"{'='*70}")
+        avg_with = statistics.fmean(with_xmp)
+        avg_without = statistics.fmean(without_xmp)
+        std_with = statistics.stdev(with_xmp) if len(with_xmp) > 1 else 0
+        std_without = statistics.stdev(without_xmp) if len(without_xmp) > 1 else 0
+        print(f"  With XMP:    {avg_with:.3f}s ±{std_with:.3f}s (n={len(with_xmp)})")
+        print(f"  Without XMP: {avg_without:.3f}s ±{std_without:.3f}s (n={len(without_xmp)})")
+        print(f"  Difference:  {avg_with - avg_without:+.3f}s ({(avg_with/avg_without - 1)*100:+.1f}%)")
+
+def print_rss_trajectory(results):
+    """RSS after each image, per run: a steady climb across runs is a leak"""
+    by_run = {}
+    for r in results:
+        if r.get('rss_after'):
+            by_run.setdefault(r['run'], []).append(r['rss_after'])
+    if not by_run:
+        return
+
+    print(f"\n{'='*70}")
+    print("RSS AFTER EACH IMAGE (VmRSS, per run)")
+    print(f"{'='*70}")
+    for run, rss in sorted(by_run.items()):
+        print(f"  Run {run}: first={rss[0] / 1024:.1f}MB  last={rss[-1] / 1024:.1f}MB  "
+              f"max={max(rss) / 1024:.1f}MB")
+    runs = sorted(by_run)
+    if len(runs) > 1:
+        growth = by_run[runs[-1]][-1] - by_run[runs[0]][-1]
+        print(f"  Growth (last image, run {runs[0]} -> {runs[-1]}): {growth / 1024:+.1f}MB")
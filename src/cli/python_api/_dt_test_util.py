@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Shared helpers of the test scripts.
+
+test_dt_api.py and test_buffer_export.py build the same dt_init() argv and
+look up the same export modules; src/cli/test_wrapper.py packs its path
+arrays the same way for the Phase 1 wrapper, so pack_strings() takes the
+cffi module to allocate with.
+"""
+
+try:
+    from _dt_api import ffi, lib
+except ImportError:  # test_wrapper.py only needs pack_strings()
+    ffi = lib = None
+
+# cffi allocators without the zero-fill: every byte is written right after
+_allocators = {}
+
+def pack_strings(ffi_, items, terminate=True):
+    """items -> (char*[] array, keepalive) with two allocations for any count
+
+    The strings share one NUL-separated char[] block and the array points
+    into it, NULL-terminated if terminate; keepalive must outlive every use
+    of the array.
+    """
+    alloc = _allocators.get(ffi_)
+    if alloc is None:
+        alloc = _allocators[ffi_] = ffi_.new_allocator(should_clear_after_alloc=False)
+    joined = b"\0".join(items) + b"\0"
+    block = alloc("char[]", len(joined))
+    ffi_.memmove(block, joined, len(joined))
+    array = alloc("char*[]", len(items) + 1 if terminate else len(items))
+    offset = 0
+    for i, item in enumerate(items):
+        array[i] = block + offset
+        offset += len(item) + 1
+    if terminate:
+        array[len(items)] = ffi_.NULL
+    return array, (block, array)
+
+def build_argv(args):
+    """args -> (argc, argv, keepalive) for dt_init(), see pack_strings()"""
+    argv, keepalive = pack_strings(ffi, args)
+    return len(args), argv, keepalive
+
+# Format/storage module pointers by name; dt_cleanup() invalidates them,
+# so shut down through cleanup()
+_formats = {}
+_storages = {}
+
+def get_format(name):
+    """dt_imageio_get_format_by_name(), looked up once per dt_init()"""
+    module = _formats.get(name)
+    if module is None:
+        module = lib.dt_imageio_get_format_by_name(name)
+        if module != ffi.NULL:
+            _formats[name] = module
+    return module
+
+def get_storage(name):
+    """dt_imageio_get_storage_by_name(), looked up once per dt_init()"""
+    module = _storages.get(name)
+    if module is None:
+        module = lib.dt_imageio_get_storage_by_name(name)
+        if module != ffi.NULL:
+            _storages[name] = module
+    return module
+
+def cleanup():
+    """dt_cleanup(), dropping the module pointers it invalidates"""
+    _formats.clear()
+    _storages.clear()
+    lib.dt_cleanup()
@@ -4,14 +4,23 @@ Phase 2: Batch Processing Benchmark
 
 Tests the Python API with multiple unique files to identify bottlenecks.
 Processes each file N times to get statistical significance.
+
+--workers N spreads the images over N processes, each with its own
+dt_init() and export modules.
 """
 
+import argparse
+import multiprocessing
+import multiprocessing.util
 import os
 import time
-import glob
 import statistics
 import csv
 import sys
+import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
 from _dt_api import ffi, lib
 
 # Configuration
@@ -23,33 +32,42 @@ NUM_RUNS = 3  # Process each file this many times
 OUTPUT_WIDTH = 1920
 OUTPUT_HEIGHT = 1080
 
-class TeeOutput:
-    """Write to both stdout and file simultaneously"""
-    def __init__(self, filename):
-        self.terminal = sys.stdout
-        self.log = open(filename, 'w')
-
-    def write(self, message):
-        self.terminal.write(message)
-        self.log.write(message)
-
-    def flush(self):
-        self.terminal.flush()
-        self.log.flush()
-
-    def close(self):
-        self.log.close()
+# Report output (see setup_logging); a fixed name so --workers processes,
+# which import this module as __mp_main__, log to the same logger
+logger = logging.getLogger("benchmark_batch")
+
+def setup_logging(log_queue):
+    """Send this process's report lines through log_queue"""
+    logger.handlers[:] = [QueueHandler(log_queue)]
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+def start_log_listener(log_queue):
+    """Drain log_queue into the report file and the terminal"""
+    formatter = logging.Formatter('%(message)s')
+    handlers = [logging.FileHandler(RESULTS_REPORT, mode='w'), logging.StreamHandler(sys.stdout)]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    listener = QueueListener(log_queue, *handlers)
+    listener.start()
+    return listener
 
 def get_test_files():
     """Get all ARW files and check for XMP sidecars"""
-    arw_files = glob.glob("/mnt/2t4/development/darktable/test_data/*.ARW")
-    arw_files += glob.glob("/mnt/2t4/development/darktable/test_data/*.arw")
+    # One directory listing answers both questions: which raws exist and
+    # which of them have a sidecar (no per-file os.path.exists)
+    test_dir = TEST_DATA_DIR.decode()
+    with os.scandir(test_dir) as it:
+        names = {e.name for e in it}
+    arw_files = [os.path.join(test_dir, name) for name in names
+                 if name.endswith((".ARW", ".arw"))]
 
     files = []
     for arw in sorted(arw_files):
-        has_xmp = os.path.exists(arw + ".xmp")
+        has_xmp = os.path.basename(arw) + ".xmp" in names
         files.append({
             'path': arw.encode(),
+            'dir': os.path.dirname(arw).encode(),  # film roll, encoded once
             'name': os.path.basename(arw),
             'has_xmp': has_xmp
         })
@@ -70,49 +88,133 @@ def init_darktable():
                          b"/home/glen/Applications/Darktable/bin")
     return result == 0
 
-def process_image(input_path, output_path):
-    """Process a single image and return timing breakdown"""
-    times = {}
+def prefetch_inputs(jobs, ready):
+    """Reader thread: start reading each input into the page cache, then queue it
+
+    The export calls share one set of params and are not reentrant, so all
+    darktable work stays on the main thread; this only overlaps the disk read of the next file with the
+    export of the current one. The bounded queue keeps it at most a couple
+    of files ahead.
+    """
+    for job in jobs:
+        _, file_info, _ = job
+        if hasattr(os, 'posix_fadvise'):
+            try:
+                fd = os.open(file_info['path'], os.O_RDONLY)
+                try:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                finally:
+                    os.close(fd)
+            except OSError:
+                pass  # import reports unreadable files itself
+        ready.put(job)
+    ready.put(None)
+
+def setup_export():
+    """Look up the JPEG format / disk storage modules and allocate their params
+
+    Like darktable's own export job, this happens once per batch; only the
+    output path is configured per image. Returns None on failure.
+    """
+    format_mod = lib.dt_imageio_get_format_by_name(b"jpeg")
+    storage_mod = lib.dt_imageio_get_storage_by_name(b"disk")
 
-    # Get directory for film
-    directory = os.path.dirname(input_path.decode()).encode()
+    if not format_mod or not storage_mod:
+        return None
 
-    # Time: Film creation
-    t0 = time.perf_counter()
-    filmid = lib.dt_shim_film_new(directory)
-    times['film_new'] = time.perf_counter() - t0
+    fdata = lib.dt_shim_format_get_params(format_mod)
+    sdata = lib.dt_shim_storage_get_params(storage_mod)
 
-    if not lib.dt_is_valid_filmid(filmid):
+    if not fdata or not sdata:
+        lib.dt_shim_format_free_params(format_mod, fdata)
+        lib.dt_shim_storage_free_params(storage_mod, sdata)
         return None
 
-    # Time: Image import
+    return format_mod, storage_mod, fdata, sdata
+
+def write_csv_rows(path, fieldnames, rows):
+    """Writer thread: write CSV rows from the queue until None arrives
+
+    Every row is flushed so the file can still be tailed, but the write and
+    flush happen here instead of between timed images on the main thread.
+    """
+    with open(path, 'w', newline='') as csv_file:
+        csv_writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
+        csv_writer.writeheader()
+        csv_file.flush()
+        while (row := rows.get()) is not None:
+            csv_writer.writerow(row)
+            csv_file.flush()
+
+# Per-worker darktable state for --workers, set up once by the pool initializer
+_worker_export = None
+
+def _init_worker(log_queue):
+    """Pool initializer: dt_init() and export module setup, once per worker
+
+    The matching teardown (_cleanup_worker) runs when the worker exits
+    after pool.close(), as the in-process path does after its batch.
+    """
+    global _worker_export
+    setup_logging(log_queue)
     t0 = time.perf_counter()
-    imgid = lib.dt_image_import(filmid, input_path, True, True)
-    times['import'] = time.perf_counter() - t0
+    if not init_darktable():
+        return
+    _worker_export = setup_export()
+    multiprocessing.util.Finalize(None, _cleanup_worker, exitpriority=10)
+    logger.info(f"  worker {os.getpid()}: dt_init + export setup in {time.perf_counter() - t0:.3f}s")
+
+def _cleanup_worker():
+    """Worker exit: free the export modules' params, then dt_cleanup()"""
+    if _worker_export is not None:
+        format_mod, storage_mod, fdata, sdata = _worker_export
+        lib.dt_shim_storage_finalize(storage_mod, sdata)
+        lib.dt_shim_storage_free_params(storage_mod, sdata)
+        lib.dt_shim_format_free_params(format_mod, fdata)
+    lib.dt_cleanup()
 
-    if not lib.dt_is_valid_imgid(imgid):
-        return None
+def _process_job(job):
+    """Pool task: process one (run, file_info, output_path) job"""
+    run, file_info, output_path = job
+    if _worker_export is None:
+        return run, file_info, None  # dt_init or export setup failed in this worker
+    return run, file_info, process_image(file_info['path'], file_info['dir'], output_path,
+                                         *_worker_export)
 
-    # Time: Export setup (modules + config)
-    t0 = time.perf_counter()
-    format_mod = lib.dt_imageio_get_format_by_name(b"jpeg")
-    storage_mod = lib.dt_imageio_get_storage_by_name(b"disk")
+def parse_args():
+    parser = argparse.ArgumentParser(description="Phase 2: Batch Processing Benchmark")
+    parser.add_argument('--workers', type=int, default=1, metavar='N',
+                        help="process images in N worker processes (default: 1, in-process)")
+    return parser.parse_args()
 
-    if not format_mod or not storage_mod:
+def process_image(input_path, directory, output_path, format_mod, storage_mod, fdata, sdata):
+    """Process a single image and return timing breakdown (seconds)"""
+    # Integer ns deltas; converted to float seconds once at the end
+
+    # Time: Film creation
+    t0 = time.perf_counter_ns()
+    filmid = lib.dt_shim_film_new(directory)
+    t_film = time.perf_counter_ns() - t0
+
+    if not lib.dt_is_valid_filmid(filmid):
         return None
 
-    fdata = lib.dt_shim_format_get_params(format_mod)
-    sdata = lib.dt_shim_storage_get_params(storage_mod)
+    # Time: Image import
+    t0 = time.perf_counter_ns()
+    imgid = lib.dt_image_import(filmid, input_path, True, True)
+    t_import = time.perf_counter_ns() - t0
 
-    if not fdata or not sdata:
+    if not lib.dt_is_valid_imgid(imgid):
         return None
 
+    # Time: Export setup (per-image config; modules are set up once)
+    t0 = time.perf_counter_ns()
     lib.dt_shim_configure_export(sdata, fdata, output_path,
                                   OUTPUT_WIDTH, OUTPUT_HEIGHT)
-    times['export_setup'] = time.perf_counter() - t0
+    t_setup = time.perf_counter_ns() - t0
 
     # Time: Actual export (processing)
-    t0 = time.perf_counter()
+    t0 = time.perf_counter_ns()
     export_result = lib.dt_shim_storage_store(
         storage_mod, sdata, imgid, format_mod, fdata,
         1, 1,          # num, total
@@ -123,161 +225,235 @@ def process_image(input_path, output_path):
         ffi.NULL,      # icc_file
         0              # DT_INTENT_PERCEPTUAL
     )
-    times['export'] = time.perf_counter() - t0
-
-    # Cleanup
-    lib.dt_shim_storage_finalize(storage_mod, sdata)
-    lib.dt_shim_storage_free_params(storage_mod, sdata)
-    lib.dt_shim_format_free_params(format_mod, fdata)
+    t_export = time.perf_counter_ns() - t0
 
-    times['success'] = (export_result == 0)
-    times['total'] = sum(v for k, v in times.items() if k != 'success')
+    total_ns = t_film + t_import + t_setup + t_export
 
-    return times
+    return {
+        'film_new': t_film / 1e9,
+        'import': t_import / 1e9,
+        'export_setup': t_setup / 1e9,
+        'export': t_export / 1e9,
+        'total': total_ns / 1e9,
+        'success': export_result == 0,
+    }
 
 def main():
-    # Set up output tee (stdout + file)
-    tee = TeeOutput(RESULTS_REPORT)
-    original_stdout = sys.stdout
-    sys.stdout = tee
-
-    print("=" * 70)
-    print("Phase 2: Batch Processing Benchmark")
-    print("=" * 70)
-    print(f"\nResults will be saved to:")
-    print(f"  Report: {RESULTS_REPORT}")
-    print(f"  CSV:    {RESULTS_CSV}")
+    args = parse_args()
+
+    # Report lines go to stdout + file through one listener thread, which
+    # also collects the lines logged by --workers processes
+    log_queue = multiprocessing.get_context('forkserver').Queue()
+    setup_logging(log_queue)
+    listener = start_log_listener(log_queue)
+    try:
+        return run_benchmark(args, log_queue)
+    finally:
+        listener.stop()
+
+def run_benchmark(args, log_queue):
+    logger.info("=" * 70)
+    logger.info("Phase 2: Batch Processing Benchmark")
+    logger.info("=" * 70)
+    logger.info("\nResults will be saved to:")
+    logger.info(f"  Report: {RESULTS_REPORT}")
+    logger.info(f"  CSV:    {RESULTS_CSV}")
 
     # Get test files
     test_files = get_test_files()
-    print(f"\nFound {len(test_files)} test files:")
+    logger.info(f"\nFound {len(test_files)} test files:")
     for f in test_files:
         xmp_status = "with XMP" if f['has_xmp'] else "no XMP"
-        print(f"  - {f['name']} ({xmp_status})")
+        logger.info(f"  - {f['name']} ({xmp_status})")
 
     # Ensure output directory exists
     os.makedirs(OUTPUT_DIR.decode(), exist_ok=True)
 
-    # Prepare CSV file
-    csv_file = open(RESULTS_CSV, 'w', newline='')
-    csv_writer = csv.DictWriter(csv_file, fieldnames=[
+    # Prepare CSV file (written by a background thread)
+    csv_rows = queue.Queue()
+    csv_thread = threading.Thread(target=write_csv_rows, args=(RESULTS_CSV, [
         'run', 'filename', 'has_xmp', 'film_new', 'import',
         'export_setup', 'export', 'total', 'success'
-    ])
-    csv_writer.writeheader()
-
-    # Initialize darktable ONCE
-    print(f"\nInitializing darktable...")
-    t0 = time.perf_counter()
-    if not init_darktable():
-        print("✗ Failed to initialize darktable")
-        return 1
-    init_time = time.perf_counter() - t0
-    print(f"✓ Initialized in {init_time:.3f}s (one-time cost)")
+    ], csv_rows), daemon=True)
+    csv_thread.start()
 
-    # Process each file NUM_RUNS times
-    print(f"\nProcessing each file {NUM_RUNS} times...")
-    print(f"Total operations: {len(test_files)} files × {NUM_RUNS} runs = {len(test_files) * NUM_RUNS}")
-    print()
+    # (run, file_info, output_path) in processing order
+    jobs = []
+    for run in range(NUM_RUNS):
+        for file_info in test_files:
+            output_name = f"run{run+1}_{file_info['name']}.jpg"
+            output_path = os.path.join(OUTPUT_DIR.decode(), output_name).encode()
+            jobs.append((run, file_info, output_path))
 
     all_results = []
 
-    for run in range(NUM_RUNS):
-        print(f"Run {run + 1}/{NUM_RUNS}:")
-        for file_info in test_files:
-            input_path = file_info['path']
-            output_name = f"run{run+1}_{file_info['name']}.jpg".encode()
-            output_path = os.path.join(OUTPUT_DIR.decode(),
-                                      output_name.decode()).encode()
-
-            times = process_image(input_path, output_path)
-
-            if times and times['success']:
-                result_row = {
-                    'run': run + 1,
-                    'filename': file_info['name'],
-                    'has_xmp': file_info['has_xmp'],
-                    'film_new': times['film_new'],
-                    'import': times['import'],
-                    'export_setup': times['export_setup'],
-                    'export': times['export'],
-                    'total': times['total'],
-                    'success': True
-                }
-                all_results.append({
-                    **file_info,
-                    **times,
-                    'run': run + 1
-                })
-                csv_writer.writerow(result_row)
-                csv_file.flush()  # Flush after each write so you can tail it
-                print(f"  ✓ {file_info['name']:20s} "
-                      f"total={times['total']:.3f}s "
-                      f"(film={times['film_new']:.3f}s, "
-                      f"import={times['import']:.3f}s, "
-                      f"setup={times['export_setup']:.3f}s, "
-                      f"export={times['export']:.3f}s)")
-            else:
-                csv_writer.writerow({
-                    'run': run + 1,
-                    'filename': file_info['name'],
-                    'has_xmp': file_info['has_xmp'],
-                    'success': False
-                })
-                csv_file.flush()
-                print(f"  ✗ {file_info['name']:20s} FAILED")
-
-    # Cleanup darktable
-    print("\nCleaning up...")
-    lib.dt_cleanup()
+    def record(run, file_info, times):
+        """Collect one image's result: CSV row, analysis entry, progress line"""
+        if times and times['success']:
+            result_row = {
+                'run': run + 1,
+                'filename': file_info['name'],
+                'has_xmp': file_info['has_xmp'],
+                'film_new': times['film_new'],
+                'import': times['import'],
+                'export_setup': times['export_setup'],
+                'export': times['export'],
+                'total': times['total'],
+                'success': True
+            }
+            all_results.append({
+                **file_info,
+                **times,
+                'run': run + 1
+            })
+            csv_rows.put(result_row)
+            logger.info(f"  ✓ {file_info['name']:20s} "
+                        f"total={times['total']:.3f}s "
+                        f"(film={times['film_new']:.3f}s, "
+                        f"import={times['import']:.3f}s, "
+                        f"setup={times['export_setup']:.3f}s, "
+                        f"export={times['export']:.3f}s)")
+        else:
+            csv_rows.put({
+                'run': run + 1,
+                'filename': file_info['name'],
+                'has_xmp': file_info['has_xmp'],
+                'success': False
+            })
+            logger.info(f"  ✗ {file_info['name']:20s} FAILED")
+
+    if args.workers > 1:
+        # Every export already runs OpenMP threads: split the cores between
+        # the workers instead of oversubscribing them (inherited by the
+        # forkserver, which starts with the pool)
+        omp_threads = max(1, (os.cpu_count() or 1) // args.workers)
+        os.environ['OMP_NUM_THREADS'] = str(omp_threads)
+
+        # Each worker logs its own dt_init time; it is part of the batch time
+        logger.info(f"\nStarting {args.workers} workers ({omp_threads} OpenMP threads each)...")
+        pool = multiprocessing.get_context('forkserver').Pool(args.workers,
+                                                               initializer=_init_worker,
+                                                               initargs=(log_queue,))
+        export_init_time = None
+
+        logger.info(f"\nProcessing each file {NUM_RUNS} times...")
+        logger.info(f"Total operations: {len(test_files)} files × {NUM_RUNS} runs = {len(test_files) * NUM_RUNS}")
+        logger.info("")
+
+        t0 = time.perf_counter()
+        try:
+            for run, file_info, times in pool.imap_unordered(_process_job, jobs, chunksize=1):
+                record(run, file_info, times)
+        except BaseException:
+            pool.terminate()
+            raise
+        batch_time = time.perf_counter() - t0
+        # close() rather than terminate(), so every worker runs _cleanup_worker()
+        pool.close()
+        pool.join()
+        csv_rows.put(None)
+        csv_thread.join()
+    else:
+        # Initialize darktable ONCE
+        logger.info("\nInitializing darktable...")
+        t0 = time.perf_counter()
+        if not init_darktable():
+            logger.info("✗ Failed to initialize darktable")
+            return 1
+        init_time = time.perf_counter() - t0
+        logger.info(f"✓ Initialized in {init_time:.3f}s (one-time cost)")
+
+        t0 = time.perf_counter()
+        export_modules = setup_export()
+        if not export_modules:
+            logger.info("✗ Failed to set up JPEG/disk export modules")
+            lib.dt_cleanup()
+            return 1
+        format_mod, storage_mod, fdata, sdata = export_modules
+        export_init_time = time.perf_counter() - t0
+        logger.info(f"✓ Export modules ready in {export_init_time:.6f}s (one-time cost)")
+
+        # Process each file NUM_RUNS times
+        logger.info(f"\nProcessing each file {NUM_RUNS} times...")
+        logger.info(f"Total operations: {len(test_files)} files × {NUM_RUNS} runs = {len(test_files) * NUM_RUNS}")
+        logger.info("")
+
+        # Jobs are fed through a reader thread that prefetches the next input
+        ready = queue.Queue(maxsize=2)
+        reader = threading.Thread(target=prefetch_inputs, args=(jobs, ready), daemon=True)
+        reader.start()
+
+        t0 = time.perf_counter()
+        current_run = None
+        while (job := ready.get()) is not None:
+            run, file_info, output_path = job
+            if run != current_run:
+                current_run = run
+                logger.info(f"Run {run + 1}/{NUM_RUNS}:")
+            times = process_image(file_info['path'], file_info['dir'], output_path,
+                                  *export_modules)
+            record(run, file_info, times)
+        batch_time = time.perf_counter() - t0
+        reader.join()
+        csv_rows.put(None)
+        csv_thread.join()
+
+        # Cleanup export modules, then darktable
+        logger.info("\nCleaning up...")
+        lib.dt_shim_storage_finalize(storage_mod, sdata)
+        lib.dt_shim_storage_free_params(storage_mod, sdata)
+        lib.dt_shim_format_free_params(format_mod, fdata)
+        lib.dt_cleanup()
 
     # Analyze results
-    print("\n" + "=" * 70)
-    print("ANALYSIS")
-    print("=" * 70)
+    logger.info("\n" + "=" * 70)
+    logger.info("ANALYSIS")
+    logger.info("=" * 70)
 
     if not all_results:
-        print("No successful runs to analyze")
+        logger.info("No successful runs to analyze")
         return 1
 
-    # Overall statistics
+    # Overall statistics - one pass over the results to split out the
+    # timing columns, then fmean/stdev per column
     total_images = len(all_results)
-    avg_total = sum(r['total'] for r in all_results) / total_images
-    avg_film = sum(r['film_new'] for r in all_results) / total_images
-    avg_import = sum(r['import'] for r in all_results) / total_images
-    avg_setup = sum(r['export_setup'] for r in all_results) / total_images
-    avg_export = sum(r['export'] for r in all_results) / total_images
-
-    # Calculate standard deviations
-    std_total = statistics.stdev([r['total'] for r in all_results]) if len(all_results) > 1 else 0
-    std_film = statistics.stdev([r['film_new'] for r in all_results]) if len(all_results) > 1 else 0
-    std_import = statistics.stdev([r['import'] for r in all_results]) if len(all_results) > 1 else 0
-    std_export = statistics.stdev([r['export'] for r in all_results]) if len(all_results) > 1 else 0
-
-    print(f"\nProcessed: {total_images} images")
-    print(f"Init time: {init_time:.3f}s (one-time overhead)")
-    print(f"\nPer-image averages (± std dev):")
-    print(f"  Total:        {avg_total:.4f}s (±{std_total:.4f}s)")
-    print(f"  Film new:     {avg_film:.6f}s (±{std_film:.6f}s) ({avg_film/avg_total*100:.1f}%)")
-    print(f"  Import:       {avg_import:.6f}s (±{std_import:.6f}s) ({avg_import/avg_total*100:.1f}%)")
-    print(f"  Export setup: {avg_setup:.6f}s ({avg_setup/avg_total*100:.1f}%)")
-    print(f"  Export:       {avg_export:.4f}s (±{std_export:.4f}s) ({avg_export/avg_total*100:.1f}%)")
+    stages = ('total', 'film_new', 'import', 'export_setup', 'export')
+    columns = dict(zip(stages, zip(*([r[k] for k in stages] for r in all_results))))
+    avg = {k: statistics.fmean(v) for k, v in columns.items()}
+    std = {k: statistics.stdev(v) if total_images > 1 else 0 for k, v in columns.items()}
+
+    avg_total, avg_film, avg_import, avg_setup, avg_export = (avg[k] for k in stages)
+    std_total, std_film, std_import, std_export = (std[k] for k in ('total', 'film_new', 'import', 'export'))
+
+    logger.info(f"\nProcessed: {total_images} images")
+    if export_init_time is None:
+        logger.info(f"Workers: {args.workers} (dt_init in each, included in the batch wall time)")
+    else:
+        logger.info(f"Init time: {init_time:.3f}s (one-time overhead)")
+        logger.info(f"Export module setup: {export_init_time:.6f}s (one-time overhead)")
+    logger.info(f"Batch wall time: {batch_time:.3f}s ({total_images / batch_time:.2f} images/s)")
+    logger.info("\nPer-image averages (± std dev):")
+    logger.info(f"  Total:        {avg_total:.4f}s (±{std_total:.4f}s)")
+    logger.info(f"  Film new:     {avg_film:.6f}s (±{std_film:.6f}s) ({avg_film/avg_total*100:.1f}%)")
+    logger.info(f"  Import:       {avg_import:.6f}s (±{std_import:.6f}s) ({avg_import/avg_total*100:.1f}%)")
+    logger.info(f"  Export setup: {avg_setup:.6f}s ({avg_setup/avg_total*100:.1f}%)")
+    logger.info(f"  Export:       {avg_export:.4f}s (±{std_export:.4f}s) ({avg_export/avg_total*100:.1f}%)")
 
     # XMP comparison
     with_xmp = [r for r in all_results if r['has_xmp']]
     without_xmp = [r for r in all_results if not r['has_xmp']]
 
     if with_xmp and without_xmp:
-        print(f"\nXMP sidecar effect:")
+        logger.info("\nXMP sidecar effect:")
         avg_with = sum(r['total'] for r in with_xmp) / len(with_xmp)
         avg_without = sum(r['total'] for r in without_xmp) / len(without_xmp)
-        print(f"  With XMP:    {avg_with:.3f}s (n={len(with_xmp)})")
-        print(f"  Without XMP: {avg_without:.3f}s (n={len(without_xmp)})")
+        logger.info(f"  With XMP:    {avg_with:.3f}s (n={len(with_xmp)})")
+        logger.info(f"  Without XMP: {avg_without:.3f}s (n={len(without_xmp)})")
         diff = avg_with - avg_without
-        print(f"  Difference:  {diff:+.3f}s ({diff/avg_without*100:+.1f}%)")
+        logger.info(f"  Difference:  {diff:+.3f}s ({diff/avg_without*100:+.1f}%)")
 
     # Identify bottleneck
-    print(f"\nBottleneck identification:")
+    logger.info("\nBottleneck identification:")
     operations = {
         'film_new': avg_film,
         'import': avg_import,
@@ -285,17 +461,17 @@ def main():
         'export': avg_export
     }
     bottleneck = max(operations, key=operations.get)
-    print(f"  Slowest operation: {bottleneck} ({operations[bottleneck]:.3f}s)")
+    logger.info(f"  Slowest operation: {bottleneck} ({operations[bottleneck]:.3f}s)")
 
     if avg_import > avg_total * 0.3:
-        print(f"  ⚠️  Import takes {avg_import/avg_total*100:.0f}% of time - likely database/duplicate checking")
+        logger.info(f"  ⚠️  Import takes {avg_import/avg_total*100:.0f}% of time - likely database/duplicate checking")
     if avg_export > avg_total * 0.5:
-        print(f"  ℹ️  Export takes {avg_export/avg_total*100:.0f}% of time - this is expected (actual processing)")
+        logger.info(f"  ℹ️  Export takes {avg_export/avg_total*100:.0f}% of time - this is expected (actual processing)")
     if avg_film > 0.1:
-        print(f"  ⚠️  Film creation is slow ({avg_film:.3f}s) - consider reusing films")
+        logger.info(f"  ⚠️  Film creation is slow ({avg_film:.3f}s) - consider reusing films")
 
     # Per-file breakdown
-    print(f"\nPer-file statistics (across {NUM_RUNS} runs):")
+    logger.info(f"\nPer-file statistics (across {NUM_RUNS} runs):")
     for file_info in test_files:
         file_results = [r for r in all_results if r['name'] == file_info['name']]
         if file_results:
@@ -303,22 +479,17 @@ def main():
             file_avg = statistics.mean(file_times)
             file_std = statistics.stdev(file_times) if len(file_times) > 1 else 0
             xmp_marker = " (XMP)" if file_info['has_xmp'] else ""
-            print(f"  {file_info['name']:20s}{xmp_marker:6s}: "
-                  f"{file_avg:.4f}s ±{file_std:.4f}s  "
-                  f"[{min(file_times):.4f}s - {max(file_times):.4f}s]")
-
-    print("\n" + "=" * 70)
-    print(f"✓ Benchmark complete")
-    print(f"\nResults saved to:")
-    print(f"  Report: {RESULTS_REPORT}")
-    print(f"  CSV:    {RESULTS_CSV}")
-    print(f"  Images: {OUTPUT_DIR.decode()}")
-    print("=" * 70)
-
-    # Close files
-    csv_file.close()
-    sys.stdout = original_stdout
-    tee.close()
+            logger.info(f"  {file_info['name']:20s}{xmp_marker:6s}: "
+                        f"{file_avg:.4f}s ±{file_std:.4f}s  "
+                        f"[{min(file_times):.4f}s - {max(file_times):.4f}s]")
+
+    logger.info("\n" + "=" * 70)
+    logger.info("✓ Benchmark complete")
+    logger.info("\nResults saved to:")
+    logger.info(f"  Report: {RESULTS_REPORT}")
+    logger.info(f"  CSV:    {RESULTS_CSV}")
+    logger.info(f"  Images: {OUTPUT_DIR.decode()}")
+    logger.info("=" * 70)
 
     return 0
 
@@ -4,154 +4,95 @@ Phase 2: Detailed Benchmark WITHOUT State Reuse
 
 Measures every operation with high granularity to understand time proportions.
 Init+process+cleanup FOR EACH IMAGE (darktable-cli pattern).
+
+Every image gets its own darktable instance with a :memory: library, so
+the (run, file) items share nothing and can be spread over a process pool
+(--workers N). The default of 1 measures serially with darktable's full
+OpenMP threads, comparable to benchmark_detailed_state_reuse.py.
 """
 
+import argparse
+import multiprocessing
 import os
 import time
-import glob
-import statistics
 import csv
 import sys
-from _dt_api import ffi, lib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from _dt_bench_core import (NUM_RUNS, OUTPUT_ROOT, NUM_WARMUP, TeeOutput, get_test_files,
+                            make_output_dir, output_paths, warmup_path, prepare_inputs, drop_input,
+                            pin_process, lock_memory, pause_gc, collect_gc, rss_kb,
+                            PREP_OPS, format_prep, timer_note,
+                            init_once, cleanup_once, process_image, csv_row,
+                            analyze, print_stats, print_xmp_effect, print_rss_trajectory)
 
 # Configuration
-TEST_DATA_DIR = b"/mnt/2t4/development/darktable/test_data"
-OUTPUT_DIR = b"/tmp/dt_benchmark_output_detailed_no_reuse"
+OUTPUT_DIR = OUTPUT_ROOT + b"/dt_benchmark_output_detailed_no_reuse"
 RESULTS_CSV = "/tmp/dt_benchmark_detailed_no_state_reuse.csv"
 RESULTS_REPORT = "/tmp/dt_benchmark_detailed_no_state_reuse.txt"
-NUM_RUNS = 3
-OUTPUT_WIDTH = 1920
-OUTPUT_HEIGHT = 1080
-
-class TeeOutput:
-    """Write to both stdout and file simultaneously"""
-    def __init__(self, filename):
-        self.terminal = sys.stdout
-        self.log = open(filename, 'w')
-
-    def write(self, message):
-        self.terminal.write(message)
-        self.log.write(message)
-
-    def flush(self):
-        self.terminal.flush()
-        self.log.flush()
-
-    def close(self):
-        self.log.close()
-
-def get_test_files():
-    """Get all ARW files and check for XMP sidecars"""
-    arw_files = glob.glob("/mnt/2t4/development/darktable/test_data/*.ARW")
-    arw_files += glob.glob("/mnt/2t4/development/darktable/test_data/*.arw")
-
-    files = []
-    for arw in sorted(arw_files):
-        has_xmp = os.path.exists(arw + ".xmp")
-        files.append({
-            'path': arw.encode(),
-            'name': os.path.basename(arw),
-            'has_xmp': has_xmp
-        })
-    return files
-
-def process_image_full_cycle(input_path, output_path):
-    """Process image with full init/cleanup cycle - detailed timing"""
-    times = {}
-    directory = os.path.dirname(input_path.decode()).encode()
-
-    # 1. Initialize darktable
-    t0 = time.perf_counter()
-    argv = [
-        ffi.new("char[]", b"darktable-benchmark"),
-        ffi.new("char[]", b"--library"),
-        ffi.new("char[]", b":memory:"),
-        ffi.new("char[]", b"--conf"),
-        ffi.new("char[]", b"write_sidecar_files=never"),
-    ]
-    argv_array = ffi.new("char*[]", argv)
-    result = lib.dt_init(5, argv_array, False, True, ffi.NULL,
-                         b"/home/glen/Applications/Darktable/bin")
-    times['dt_init'] = time.perf_counter() - t0
-
-    if result != 0:
-        times['success'] = False
-        return times
-
-    # 2. Film creation
-    t0 = time.perf_counter()
-    filmid = lib.dt_shim_film_new(directory)
-    times['film_new'] = time.perf_counter() - t0
-
-    if not lib.dt_is_valid_filmid(filmid):
-        lib.dt_cleanup()
-        times['success'] = False
-        return times
-
-    # 3. Image import
-    t0 = time.perf_counter()
-    imgid = lib.dt_image_import(filmid, input_path, True, True)
-    times['import'] = time.perf_counter() - t0
-
-    if not lib.dt_is_valid_imgid(imgid):
-        lib.dt_cleanup()
-        times['success'] = False
-        return times
+OMP_THREADS_PER_WORKER = 2  # darktable's own OpenMP threads in each worker (--workers > 1)
 
-    # 4. Get export modules
-    t0 = time.perf_counter()
-    format_mod = lib.dt_imageio_get_format_by_name(b"jpeg")
-    storage_mod = lib.dt_imageio_get_storage_by_name(b"disk")
-    times['module_lookup'] = time.perf_counter() - t0
+OPERATIONS = ['dt_init', 'film_new', 'import', *PREP_OPS,
+              'export_processing', 'export_cleanup', 'dt_cleanup', 'total']
 
-    if not format_mod or not storage_mod:
-        lib.dt_cleanup()
-        times['success'] = False
+def process_image_full_cycle(input_path, directory, output_path):
+    """Process image with full init/cleanup cycle - detailed timing"""
+    times = init_once()
+    if not times['success']:
         return times
 
-    # 5. Get module parameters
-    t0 = time.perf_counter()
-    fdata = lib.dt_shim_format_get_params(format_mod)
-    sdata = lib.dt_shim_storage_get_params(storage_mod)
-    times['module_params'] = time.perf_counter() - t0
-
-    if not fdata or not sdata:
-        lib.dt_cleanup()
-        times['success'] = False
-        return times
+    times.update(process_image(input_path, directory, output_path))
+    times['dt_cleanup'] = cleanup_once()
 
-    # 6. Configure export
-    t0 = time.perf_counter()
-    lib.dt_shim_configure_export(sdata, fdata, output_path,
-                                  OUTPUT_WIDTH, OUTPUT_HEIGHT)
-    times['configure_export'] = time.perf_counter() - t0
-
-    # 7. Actual export (processing)
-    t0 = time.perf_counter()
-    export_result = lib.dt_shim_storage_store(
-        storage_mod, sdata, imgid, format_mod, fdata,
-        1, 1, True, False, False, 1, ffi.NULL, 0
-    )
-    times['export_processing'] = time.perf_counter() - t0
-
-    # 8. Export cleanup
-    t0 = time.perf_counter()
-    lib.dt_shim_storage_finalize(storage_mod, sdata)
-    lib.dt_shim_storage_free_params(storage_mod, sdata)
-    lib.dt_shim_format_free_params(format_mod, fdata)
-    times['export_cleanup'] = time.perf_counter() - t0
-
-    # 9. Cleanup darktable
-    t0 = time.perf_counter()
-    lib.dt_cleanup()
-    times['dt_cleanup'] = time.perf_counter() - t0
-
-    times['success'] = (export_result == 0)
-    times['total'] = sum(v for k, v in times.items() if k != 'success')
+    if times['success']:
+        times['total'] += times['dt_init'] + times['dt_cleanup']
 
     return times
 
+def init_worker(file_info, next_slot, pin):
+    """Pool initializer: pin to a CPU block, then run untimed full cycles
+
+    With pin (more than one worker), each worker gets its own block of
+    OMP_THREADS_PER_WORKER CPUs (next_slot is a shared counter handing them
+    out round-robin), so workers and their OpenMP threads don't migrate
+    onto each other. The warmup cycles keep each worker's first timed
+    dt_init from paying for loading plugins and priming the page cache.
+    """
+    if pin and hasattr(os, 'sched_setaffinity'):
+        with next_slot.get_lock():
+            slot = next_slot.value
+            next_slot.value += 1
+        cpus = sorted(os.sched_getaffinity(0))
+        start = slot * OMP_THREADS_PER_WORKER
+        pin_process({cpus[(start + i) % len(cpus)] for i in range(OMP_THREADS_PER_WORKER)})
+    lock_memory()
+
+    for _ in range(NUM_WARMUP if file_info else 0):
+        process_image_full_cycle(file_info['path'], file_info['dir'], warmup_path(OUTPUT_DIR))
+
+    # GC only runs between jobs (see run_job)
+    pause_gc()
+
+def run_job(job):
+    """Pool task: full init/process/cleanup cycle for one (run, file_info, output_path)"""
+    run, file_info, output_path = job
+    drop_input(file_info)
+    times = process_image_full_cycle(file_info['path'], file_info['dir'], output_path)
+    # The worker's RSS after dt_cleanup(): whatever a cycle leaks stays here
+    times['rss_after'] = rss_kb()
+    collect_gc()
+    return run, file_info, times
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Phase 2: Detailed Benchmark WITHOUT State Reuse")
+    parser.add_argument('--workers', type=int, default=1, metavar='N',
+                        help="worker processes, each running its own dt_init() per image; "
+                             f"above 1, each is pinned to {OMP_THREADS_PER_WORKER} CPUs and "
+                             "OpenMP threads (default: 1, serial)")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+
     # Set up output tee
     tee = TeeOutput(RESULTS_REPORT)
     original_stdout = sys.stdout
@@ -171,17 +112,15 @@ def main():
     for f in test_files:
         xmp_status = "with XMP" if f['has_xmp'] else "no XMP"
         print(f"  - {f['name']} ({xmp_status})")
+    print(prepare_inputs(test_files))
+    print(timer_note())
 
-    os.makedirs(OUTPUT_DIR.decode(), exist_ok=True)
+    make_output_dir(OUTPUT_DIR)
 
     # Prepare CSV
-    csv_file = open(RESULTS_CSV, 'w', newline='')
-    csv_writer = csv.DictWriter(csv_file, fieldnames=[
-        'run', 'filename', 'has_xmp',
-        'dt_init', 'film_new', 'import', 'module_lookup', 'module_params',
-        'configure_export', 'export_processing', 'export_cleanup', 'dt_cleanup',
-        'total', 'success'
-    ])
+    csv_file = open(RESULTS_CSV, 'w', newline='', buffering=1 << 16)
+    csv_writer = csv.DictWriter(csv_file, fieldnames=['run', 'filename', 'has_xmp',
+                                                      *OPERATIONS, 'success', 'rss_after'])
     csv_writer.writeheader()
 
     print(f"\n{'='*70}")
@@ -191,53 +130,50 @@ def main():
     print(f"Total operations: {len(test_files)} files × {NUM_RUNS} runs = {len(test_files) * NUM_RUNS}\n")
 
     all_results = []
-
-    for run in range(NUM_RUNS):
-        print(f"Run {run + 1}/{NUM_RUNS}:")
-        for file_info in test_files:
-            input_path = file_info['path']
-            output_name = f"run{run+1}_{file_info['name']}.jpg".encode()
-            output_path = os.path.join(OUTPUT_DIR.decode(),
-                                      output_name.decode()).encode()
-
-            times = process_image_full_cycle(input_path, output_path)
+    result_rows = []  # CSV rows, written in one batch (no per-image write/flush)
+
+    # (run, file_info, output_path) for every image; each is independent
+    paths = output_paths(OUTPUT_DIR, test_files)
+    jobs = [(run, file_info, output_path)
+            for run in range(NUM_RUNS)
+            for file_info, output_path in zip(test_files, paths[run])]
+
+    if args.workers > 1:
+        # Cap darktable's OpenMP threads in the workers so N workers don't
+        # oversubscribe the cores (inherited by the forkserver the pool starts)
+        os.environ['OMP_NUM_THREADS'] = str(OMP_THREADS_PER_WORKER)
+        threads = f"{OMP_THREADS_PER_WORKER} OpenMP threads each, pinned"
+    else:
+        threads = "serial, full OpenMP threads"
+    print(f"Workers: {args.workers} ({threads}, {NUM_WARMUP} untimed warmup cycle(s) each, "
+          f"memory locked where RLIMIT_MEMLOCK allows, GC only between images)\n")
+
+    t0 = time.perf_counter_ns()
+    mp_context = multiprocessing.get_context('forkserver')
+    with ProcessPoolExecutor(max_workers=args.workers,
+                             mp_context=mp_context,
+                             initializer=init_worker,
+                             initargs=(test_files[0] if test_files else None,
+                                       mp_context.Value('i', 0),
+                                       args.workers > 1)) as executor:
+        futures = [executor.submit(run_job, job) for job in jobs]
+        # Rows are written in completion order
+        for future in as_completed(futures):
+            run, file_info, times = future.result()
+            result_rows.append(csv_row(run, file_info, times, OPERATIONS))
 
             if times and times['success']:
-                result_row = {
-                    'run': run + 1,
-                    'filename': file_info['name'],
-                    'has_xmp': file_info['has_xmp'],
-                    'dt_init': times['dt_init'],
-                    'film_new': times['film_new'],
-                    'import': times['import'],
-                    'module_lookup': times['module_lookup'],
-                    'module_params': times['module_params'],
-                    'configure_export': times['configure_export'],
-                    'export_processing': times['export_processing'],
-                    'export_cleanup': times['export_cleanup'],
-                    'dt_cleanup': times['dt_cleanup'],
-                    'total': times['total'],
-                    'success': True
-                }
                 all_results.append({**file_info, **times, 'run': run + 1})
-                csv_writer.writerow(result_row)
-                csv_file.flush()
 
-                print(f"  ✓ {file_info['name']:20s} total={times['total']:.3f}s")
+                print(f"  ✓ [run {run + 1}] {file_info['name']:20s} total={times['total']:.3f}s")
                 print(f"      init={times['dt_init']:.3f}s, film={times['film_new']:.6f}s, "
-                      f"import={times['import']:.6f}s, lookup={times['module_lookup']:.6f}s")
-                print(f"      params={times['module_params']:.6f}s, config={times['configure_export']:.6f}s, "
-                      f"export={times['export_processing']:.3f}s")
+                      f"import={times['import']:.6f}s")
+                print(f"      {format_prep(times)}, export={times['export_processing']:.3f}s")
                 print(f"      exp_cleanup={times['export_cleanup']:.6f}s, cleanup={times['dt_cleanup']:.3f}s")
             else:
-                csv_writer.writerow({
-                    'run': run + 1,
-                    'filename': file_info['name'],
-                    'has_xmp': file_info['has_xmp'],
-                    'success': False
-                })
-                csv_file.flush()
-                print(f"  ✗ {file_info['name']:20s} FAILED")
+                print(f"  ✗ [run {run + 1}] {file_info['name']:20s} FAILED")
+    wall_time = (time.perf_counter_ns() - t0) * 1e-9
+    csv_writer.writerows(result_rows)
 
     # ====================================================================
     # ANALYSIS
@@ -256,27 +192,13 @@ def main():
     total_images = len(all_results)
 
     # Calculate averages and std devs for each operation
-    operations = ['dt_init', 'film_new', 'import', 'module_lookup', 'module_params',
-                  'configure_export', 'export_processing', 'export_cleanup', 'dt_cleanup', 'total']
-
-    stats = {}
-    for op in operations:
-        values = [r[op] for r in all_results]
-        stats[op] = {
-            'mean': statistics.mean(values),
-            'stdev': statistics.stdev(values) if len(values) > 1 else 0,
-            'min': min(values),
-            'max': max(values)
-        }
+    stats, columns = analyze(all_results, OPERATIONS)
 
     print(f"\nProcessed: {total_images} images")
+    print(f"Wall time: {wall_time:.3f}s with {args.workers} workers "
+          f"({total_images / wall_time:.2f} images/s)")
 
-    print(f"\nPer-image timing (mean ± stdev) [min - max]:")
-    for op in operations:
-        s = stats[op]
-        pct = (s['mean'] / stats['total']['mean'] * 100) if op != 'total' else 100
-        print(f"  {op:20s}: {s['mean']:.6f}s ±{s['stdev']:.6f}s  "
-              f"[{s['min']:.6f}s - {s['max']:.6f}s]  ({pct:.1f}%)")
+    print_stats(stats, OPERATIONS)
 
     # Overhead analysis
     avg_init = stats['dt_init']['mean']
@@ -297,18 +219,10 @@ def main():
           f"({(avg_init + avg_cleanup)/stats['total']['mean']*100:.1f}%)")
 
     # XMP comparison
-    with_xmp = [r for r in all_results if r['has_xmp']]
-    without_xmp = [r for r in all_results if not r['has_xmp']]
-
-    if with_xmp and without_xmp:
-        print(f"\n{'='*70}")
-        print("XMP SIDECAR EFFECT")
-        print(f"{'='*70}")
-        avg_with = statistics.mean([r['total'] for r in with_xmp])
-        avg_without = statistics.mean([r['total'] for r in without_xmp])
-        print(f"  With XMP:    {avg_with:.3f}s (n={len(with_xmp)})")
-        print(f"  Without XMP: {avg_without:.3f}s (n={len(without_xmp)})")
-        print(f"  Difference:  {avg_with - avg_without:+.3f}s ({(avg_with/avg_without - 1)*100:+.1f}%)")
+    print_xmp_effect(all_results, columns['total'])
+
+    # Workers sample their own RSS, so each run mixes several processes
+    print_rss_trajectory(all_results)
 
     print("\n" + "=" * 70)
     print(f"✓ Benchmark complete")
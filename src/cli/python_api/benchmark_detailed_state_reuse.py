@@ -8,150 +8,30 @@ Init ONCE, process all images, cleanup ONCE (persistent state pattern).
 
 import os
 import time
-import glob
-import statistics
 import csv
 import sys
-from _dt_api import ffi, lib
+from _dt_bench_core import (NUM_RUNS, OUTPUT_ROOT, NUM_WARMUP, BENCH_CPU, TeeOutput, get_test_files,
+                            make_output_dir, output_paths, warmup_path, prepare_inputs, drop_input,
+                            parse_cpu_list, pin_process, lock_memory,
+                            pause_gc, collect_gc, resume_gc, format_prep,
+                            setup_export, free_export, process_images_pipelined,
+                            timer_note, rss_kb,
+                            init_once, cleanup_once, process_image, csv_row,
+                            analyze, print_stats, print_xmp_effect, print_rss_trajectory)
 
 # Configuration
-TEST_DATA_DIR = b"/mnt/2t4/development/darktable/test_data"
-OUTPUT_DIR = b"/tmp/dt_benchmark_output_detailed_reuse"
+OUTPUT_DIR = OUTPUT_ROOT + b"/dt_benchmark_output_detailed_reuse"
 RESULTS_CSV = "/tmp/dt_benchmark_detailed_state_reuse.csv"
 RESULTS_REPORT = "/tmp/dt_benchmark_detailed_state_reuse.txt"
-NUM_RUNS = 3
-OUTPUT_WIDTH = 1920
-OUTPUT_HEIGHT = 1080
-
-class TeeOutput:
-    """Write to both stdout and file simultaneously"""
-    def __init__(self, filename):
-        self.terminal = sys.stdout
-        self.log = open(filename, 'w')
-
-    def write(self, message):
-        self.terminal.write(message)
-        self.log.write(message)
-
-    def flush(self):
-        self.terminal.flush()
-        self.log.flush()
-
-    def close(self):
-        self.log.close()
-
-def get_test_files():
-    """Get all ARW files and check for XMP sidecars"""
-    arw_files = glob.glob("/mnt/2t4/development/darktable/test_data/*.ARW")
-    arw_files += glob.glob("/mnt/2t4/development/darktable/test_data/*.arw")
-
-    files = []
-    for arw in sorted(arw_files):
-        has_xmp = os.path.exists(arw + ".xmp")
-        files.append({
-            'path': arw.encode(),
-            'name': os.path.basename(arw),
-            'has_xmp': has_xmp
-        })
-    return files
-
-def init_darktable():
-    """Initialize darktable once - return detailed timing"""
-    times = {}
-
-    t0 = time.perf_counter()
-
-    argv = [
-        ffi.new("char[]", b"darktable-benchmark"),
-        ffi.new("char[]", b"--library"),
-        ffi.new("char[]", b":memory:"),
-        ffi.new("char[]", b"--conf"),
-        ffi.new("char[]", b"write_sidecar_files=never"),
-    ]
-    argv_array = ffi.new("char*[]", argv)
-
-    result = lib.dt_init(5, argv_array, False, True, ffi.NULL,
-                         b"/home/glen/Applications/Darktable/bin")
-
-    times['dt_init'] = time.perf_counter() - t0
-    times['success'] = (result == 0)
-
-    return times
-
-def cleanup_darktable():
-    """Cleanup darktable - return timing"""
-    t0 = time.perf_counter()
-    lib.dt_cleanup()
-    return time.perf_counter() - t0
-
-def process_image(input_path, output_path):
-    """Process a single image with detailed timing breakdown"""
-    times = {}
-    directory = os.path.dirname(input_path.decode()).encode()
-
-    # 1. Film creation
-    t0 = time.perf_counter()
-    filmid = lib.dt_shim_film_new(directory)
-    times['film_new'] = time.perf_counter() - t0
-
-    if not lib.dt_is_valid_filmid(filmid):
-        times['success'] = False
-        return times
-
-    # 2. Image import (includes duplicate checking, metadata read)
-    t0 = time.perf_counter()
-    imgid = lib.dt_image_import(filmid, input_path, True, True)
-    times['import'] = time.perf_counter() - t0
-
-    if not lib.dt_is_valid_imgid(imgid):
-        times['success'] = False
-        return times
-
-    # 3. Get export modules (lookup)
-    t0 = time.perf_counter()
-    format_mod = lib.dt_imageio_get_format_by_name(b"jpeg")
-    storage_mod = lib.dt_imageio_get_storage_by_name(b"disk")
-    times['module_lookup'] = time.perf_counter() - t0
-
-    if not format_mod or not storage_mod:
-        times['success'] = False
-        return times
-
-    # 4. Get module parameters (allocate structures)
-    t0 = time.perf_counter()
-    fdata = lib.dt_shim_format_get_params(format_mod)
-    sdata = lib.dt_shim_storage_get_params(storage_mod)
-    times['module_params'] = time.perf_counter() - t0
-
-    if not fdata or not sdata:
-        times['success'] = False
-        return times
-
-    # 5. Configure export (set paths, dimensions)
-    t0 = time.perf_counter()
-    lib.dt_shim_configure_export(sdata, fdata, output_path,
-                                  OUTPUT_WIDTH, OUTPUT_HEIGHT)
-    times['configure_export'] = time.perf_counter() - t0
-
-    # 6. Actual export (processing)
-    t0 = time.perf_counter()
-    export_result = lib.dt_shim_storage_store(
-        storage_mod, sdata, imgid, format_mod, fdata,
-        1, 1, True, False, False, 1, ffi.NULL, 0
-    )
-    times['export_processing'] = time.perf_counter() - t0
-
-    # 7. Cleanup/finalize
-    t0 = time.perf_counter()
-    lib.dt_shim_storage_finalize(storage_mod, sdata)
-    lib.dt_shim_storage_free_params(storage_mod, sdata)
-    lib.dt_shim_format_free_params(format_mod, fdata)
-    times['export_cleanup'] = time.perf_counter() - t0
-
-    times['success'] = (export_result == 0)
-    times['total'] = sum(v for k, v in times.items() if k != 'success')
-
-    return times
+
+# Import image N+1 on the main thread while image N exports on another
+# (process_images_pipelined); the per-operation timings are then taken
+# under that overlap, and the breakdown uses each run's wall time
+PIPELINE_IMPORT = False
+
+# Export modules and their params are set up once (see PHASE 1), so per
+# image only configure_export and the export itself remain
+OPERATIONS = ['film_new', 'import', 'configure_export', 'export_processing', 'total']
 
 def main():
     # Set up output tee
@@ -172,17 +52,18 @@ def main():
     for f in test_files:
         xmp_status = "with XMP" if f['has_xmp'] else "no XMP"
         print(f"  - {f['name']} ({xmp_status})")
+    print(prepare_inputs(test_files))
+    if BENCH_CPU:
+        print(f"Process: {pin_process(parse_cpu_list(BENCH_CPU))}")
+    print(f"Memory: {lock_memory()}")
+    print(timer_note())
 
-    os.makedirs(OUTPUT_DIR.decode(), exist_ok=True)
+    make_output_dir(OUTPUT_DIR)
 
     # Prepare CSV
-    csv_file = open(RESULTS_CSV, 'w', newline='')
-    csv_writer = csv.DictWriter(csv_file, fieldnames=[
-        'run', 'filename', 'has_xmp',
-        'film_new', 'import', 'module_lookup', 'module_params',
-        'configure_export', 'export_processing', 'export_cleanup',
-        'total', 'success'
-    ])
+    csv_file = open(RESULTS_CSV, 'w', newline='', buffering=1 << 16)
+    csv_writer = csv.DictWriter(csv_file, fieldnames=['run', 'filename', 'has_xmp',
+                                                      *OPERATIONS, 'success', 'rss_after'])
     csv_writer.writeheader()
 
     # ====================================================================
@@ -191,7 +72,7 @@ def main():
     print(f"\n{'='*70}")
     print("INITIALIZING DARKTABLE (ONCE)")
     print(f"{'='*70}")
-    init_times = init_darktable()
+    init_times = init_once()
 
     if not init_times['success']:
         print("✗ Failed to initialize darktable")
@@ -202,63 +83,87 @@ def main():
 
     print(f"✓ dt_init: {init_times['dt_init']:.6f}s")
 
+    t0 = time.perf_counter_ns()
+    export = setup_export()
+    export_setup_time = (time.perf_counter_ns() - t0) * 1e-9
+    if export is None:
+        print("✗ Failed to set up JPEG/disk export modules")
+        cleanup_once()
+        csv_file.close()
+        sys.stdout = original_stdout
+        tee.close()
+        return 1
+    print(f"✓ Export modules + params: {export_setup_time:.6f}s")
+    init_time = init_times['dt_init'] + export_setup_time
+
+    # Untimed warmup: one-off costs of the first export after dt_init (cold
+    # page cache, lazily set up state) would otherwise land on the first
+    # timed image
+    if test_files:
+        for _ in range(NUM_WARMUP):
+            process_image(test_files[0]['path'], test_files[0]['dir'], warmup_path(OUTPUT_DIR),
+                          export)
+        print(f"✓ Warmup: {NUM_WARMUP} untimed export(s) of {test_files[0]['name']}")
+
     # ====================================================================
     # PHASE 2: Process all images (persistent state)
     # ====================================================================
     print(f"\n{'='*70}")
-    print(f"PROCESSING IMAGES (State Reuse)")
+    print(f"PROCESSING IMAGES (State Reuse{', import/export pipelined' if PIPELINE_IMPORT else ''})")
     print(f"{'='*70}")
     print(f"Processing each file {NUM_RUNS} times...")
     print(f"Total operations: {len(test_files)} files × {NUM_RUNS} runs = {len(test_files) * NUM_RUNS}\n")
 
+    # Output paths for every (run, file), built outside the timed loop
+    paths = output_paths(OUTPUT_DIR, test_files)
+
     all_results = []
+    result_rows = []  # CSV rows of the current run, written in one batch
     total_processing_time = 0
+    processing_wall_time = 0
 
+    pause_gc()
     for run in range(NUM_RUNS):
-        print(f"Run {run + 1}/{NUM_RUNS}:")
-        for file_info in test_files:
-            input_path = file_info['path']
-            output_name = f"run{run+1}_{file_info['name']}.jpg".encode()
-            output_path = os.path.join(OUTPUT_DIR.decode(),
-                                      output_name.decode()).encode()
-
-            times = process_image(input_path, output_path)
+        # Progress lines are collected and printed after the run, so no
+        # terminal/report I/O lands between two timed images
+        log_buf = [f"Run {run + 1}/{NUM_RUNS}:"]
+        jobs = list(zip(test_files, paths[run]))
+        t0 = time.perf_counter_ns()
+        if PIPELINE_IMPORT:
+            run_results = process_images_pipelined(jobs, export)
+        else:
+            run_results = []
+            for file_info, output_path in jobs:
+                drop_input(file_info)
+                times = process_image(file_info['path'], file_info['dir'], output_path, export)
+                times['rss_after'] = rss_kb()
+                run_results.append((file_info, times))
+        processing_wall_time += (time.perf_counter_ns() - t0) * 1e-9
+
+        for file_info, times in run_results:
+            result_rows.append(csv_row(run, file_info, times, OPERATIONS))
 
             if times and times['success']:
-                result_row = {
-                    'run': run + 1,
-                    'filename': file_info['name'],
-                    'has_xmp': file_info['has_xmp'],
-                    'film_new': times['film_new'],
-                    'import': times['import'],
-                    'module_lookup': times['module_lookup'],
-                    'module_params': times['module_params'],
-                    'configure_export': times['configure_export'],
-                    'export_processing': times['export_processing'],
-                    'export_cleanup': times['export_cleanup'],
-                    'total': times['total'],
-                    'success': True
-                }
                 all_results.append({**file_info, **times, 'run': run + 1})
-                csv_writer.writerow(result_row)
-                csv_file.flush()
 
                 total_processing_time += times['total']
 
-                print(f"  ✓ {file_info['name']:20s} total={times['total']:.3f}s")
-                print(f"      film={times['film_new']:.6f}s, import={times['import']:.6f}s, "
-                      f"lookup={times['module_lookup']:.6f}s, params={times['module_params']:.6f}s")
-                print(f"      config={times['configure_export']:.6f}s, export={times['export_processing']:.3f}s, "
-                      f"cleanup={times['export_cleanup']:.6f}s")
+                log_buf.append(f"  ✓ {file_info['name']:20s} total={times['total']:.3f}s\n"
+                               f"      film={times['film_new']:.6f}s, import={times['import']:.6f}s, "
+                               f"{format_prep(times)}\n"
+                               f"      export={times['export_processing']:.3f}s")
             else:
-                csv_writer.writerow({
-                    'run': run + 1,
-                    'filename': file_info['name'],
-                    'has_xmp': file_info['has_xmp'],
-                    'success': False
-                })
-                csv_file.flush()
-                print(f"  ✗ {file_info['name']:20s} FAILED")
+                log_buf.append(f"  ✗ {file_info['name']:20s} FAILED")
+
+        print("\n".join(log_buf))
+
+        # One write+flush per run rather than per image; completed runs
+        # still reach the file if a later one crashes
+        csv_writer.writerows(result_rows)
+        csv_file.flush()
+        result_rows.clear()
+        collect_gc()
+    resume_gc()
 
     # ====================================================================
     # PHASE 3: Cleanup darktable ONCE
@@ -266,8 +171,13 @@ def main():
     print(f"\n{'='*70}")
     print("CLEANING UP DARKTABLE (ONCE)")
     print(f"{'='*70}")
-    cleanup_time = cleanup_darktable()
-    print(f"✓ dt_cleanup: {cleanup_time:.6f}s")
+    t0 = time.perf_counter_ns()
+    free_export(export)
+    export_free_time = (time.perf_counter_ns() - t0) * 1e-9
+    print(f"✓ Export finalize + free: {export_free_time:.6f}s")
+    dt_cleanup_time = cleanup_once()
+    print(f"✓ dt_cleanup: {dt_cleanup_time:.6f}s")
+    cleanup_time = export_free_time + dt_cleanup_time
 
     # ====================================================================
     # ANALYSIS
@@ -286,38 +196,26 @@ def main():
     total_images = len(all_results)
 
     # Calculate averages and std devs for each operation
-    operations = ['film_new', 'import', 'module_lookup', 'module_params',
-                  'configure_export', 'export_processing', 'export_cleanup', 'total']
-
-    stats = {}
-    for op in operations:
-        values = [r[op] for r in all_results]
-        stats[op] = {
-            'mean': statistics.mean(values),
-            'stdev': statistics.stdev(values) if len(values) > 1 else 0,
-            'min': min(values),
-            'max': max(values)
-        }
+    stats, columns = analyze(all_results, OPERATIONS)
 
     print(f"\nProcessed: {total_images} images")
     print(f"\nOne-time overhead:")
-    print(f"  Init:    {init_times['dt_init']:.6f}s")
-    print(f"  Cleanup: {cleanup_time:.6f}s")
-    print(f"  Total:   {init_times['dt_init'] + cleanup_time:.6f}s")
+    print(f"  Init:    {init_time:.6f}s (dt_init + export setup)")
+    print(f"  Cleanup: {cleanup_time:.6f}s (export free + dt_cleanup)")
+    print(f"  Total:   {init_time + cleanup_time:.6f}s")
 
-    print(f"\nPer-image timing (mean ± stdev) [min - max]:")
-    for op in operations:
-        s = stats[op]
-        pct = (s['mean'] / stats['total']['mean'] * 100) if op != 'total' else 100
-        print(f"  {op:20s}: {s['mean']:.6f}s ±{s['stdev']:.6f}s  "
-              f"[{s['min']:.6f}s - {s['max']:.6f}s]  ({pct:.1f}%)")
+    print_stats(stats, OPERATIONS)
 
     # Total time breakdown
-    total_wall_time = init_times['dt_init'] + total_processing_time + cleanup_time
+    if PIPELINE_IMPORT:
+        # Overlapped images: the per-image totals add up to more than the
+        # time the runs took
+        total_processing_time = processing_wall_time
+    total_wall_time = init_time + total_processing_time + cleanup_time
     print(f"\n{'='*70}")
     print("TOTAL TIME BREAKDOWN")
     print(f"{'='*70}")
-    print(f"  Init (once):         {init_times['dt_init']:.3f}s  ({init_times['dt_init']/total_wall_time*100:.1f}%)")
+    print(f"  Init (once):         {init_time:.3f}s  ({init_time/total_wall_time*100:.1f}%)")
     print(f"  Processing ({total_images} imgs): {total_processing_time:.3f}s  ({total_processing_time/total_wall_time*100:.1f}%)")
     print(f"  Cleanup (once):      {cleanup_time:.3f}s  ({cleanup_time/total_wall_time*100:.1f}%)")
     print(f"  {'─'*68}")
@@ -325,18 +223,9 @@ def main():
     print(f"\n  Average per image:   {total_processing_time/total_images:.3f}s")
 
     # XMP comparison
-    with_xmp = [r for r in all_results if r['has_xmp']]
-    without_xmp = [r for r in all_results if not r['has_xmp']]
-
-    if with_xmp and without_xmp:
-        print(f"\n{'='*70}")
-        print("XMP SIDECAR EFFECT")
-        print(f"{'='*70}")
-        avg_with = statistics.mean([r['total'] for r in with_xmp])
-        avg_without = statistics.mean([r['total'] for r in without_xmp])
-        print(f"  With XMP:    {avg_with:.3f}s (n={len(with_xmp)})")
-        print(f"  Without XMP: {avg_without:.3f}s (n={len(without_xmp)})")
-        print(f"  Difference:  {avg_with - avg_without:+.3f}s ({(avg_with/avg_without - 1)*100:+.1f}%)")
+    print_xmp_effect(all_results, columns['total'])
+
+    print_rss_trajectory(all_results)
 
     print("\n" + "=" * 70)
     print(f"✓ Benchmark complete")
@@ -25,8 +25,20 @@ gcc -shared -fPIC \
 echo "✓ Created libdt_api_shim.so"
 
 # Build cffi Python extension
-echo "2. Building cffi Python extension..."
-python build_dt_api.py
+if [ "$1" = "pgo" ]; then
+    # LTO + profile-guided build (see build_dt_api.py); needs the test data
+    echo "2. Building instrumented cffi Python extension..."
+    rm -rf pgo
+    DT_API_PGO=generate python build_dt_api.py
+    echo "   Training run: test_buffer_export.py"
+    python test_buffer_export.py
+    echo "   Rebuilding with profile data..."
+    rm -f .build_hash
+    DT_API_PGO=use python build_dt_api.py
+else
+    echo "2. Building cffi Python extension..."
+    python build_dt_api.py
+fi
 
 echo ""
 echo "✓ Build complete!"
@@ -6,26 +6,28 @@ This exposes darktable's C functions to Python via cffi.
 """
 
 from cffi import FFI
+import glob
+import hashlib
+import os
+import re
 import subprocess
 
-# Get pkg-config flags
-def get_pkg_config(package, flag):
-    result = subprocess.run(['pkg-config', flag, package],
-                          capture_output=True, text=True, check=True)
-    return result.stdout.strip().split()
+# Get pkg-config flags - one pkg-config run for all packages, which also
+# lets it dedupe their shared dependencies; cached for repeated lookups
+_pkg_config_cache = {}
 
-glib_cflags = get_pkg_config('glib-2.0', '--cflags')
-gtk_cflags = get_pkg_config('gtk+-3.0', '--cflags')
-rsvg_cflags = get_pkg_config('librsvg-2.0', '--cflags')
-json_cflags = get_pkg_config('json-glib-1.0', '--cflags')
-
-# Combine and extract just -I flags
-extra_cflags = glib_cflags + gtk_cflags + rsvg_cflags + json_cflags
+def get_pkg_config(packages, flag):
+    key = (tuple(packages), flag)
+    if key not in _pkg_config_cache:
+        result = subprocess.run(['pkg-config', flag, *packages],
+                              capture_output=True, text=True, check=True)
+        _pkg_config_cache[key] = result.stdout.strip().split()
+    return _pkg_config_cache[key]
 
 ffibuilder = FFI()
 
 # Define the C API that Python will see
-ffibuilder.cdef("""
+CDEF = """
     // ========================================================================
     // Opaque types (we don't need to see inside these)
     // ========================================================================
@@ -148,35 +150,116 @@ ffibuilder.cdef("""
     void dt_shim_attach_buffer_to_image(dt_imgid_t imgid,
                                          const uint8_t *raw_buffer,
                                          size_t buffer_size);
-""")
 
-# Specify the source for compilation
-ffibuilder.set_source(
-    "_dt_api",
-    """
+    // Detach it again (the image reads its file from then on)
+    void dt_shim_detach_buffer_from_image(dt_imgid_t imgid);
+
+    // Attach an open raw file (mapped inside the shim)
+    void dt_shim_attach_fd_to_image(dt_imgid_t imgid, int fd, size_t len);
+
+    // Detach it again and unmap it
+    void dt_shim_detach_fd_from_image(dt_imgid_t imgid);
+"""
+ffibuilder.cdef(CDEF)
+
+SOURCE = """
     #include "dt_api_shim.h"
     #include "common/darktable.h"
     #include "common/film.h"
     #include "common/image.h"
     #include "imageio/imageio_common.h"
     #include "imageio/imageio_module.h"
-    """,
-    libraries=['dt_api_shim', 'darktable'],
-    library_dirs=[
-        '/mnt/2t4/development/darktable/darktable/src/cli/python_api',
-        '/home/glen/Applications/Darktable/lib/darktable'
-    ],
-    runtime_library_dirs=[
-        '/mnt/2t4/development/darktable/darktable/src/cli/python_api',
-        '/home/glen/Applications/Darktable/lib/darktable'
-    ],
-    include_dirs=[
-        '/mnt/2t4/development/darktable/darktable/src',
-        '/mnt/2t4/development/darktable/darktable/src/cli/python_api',
-        '/mnt/2t4/development/darktable/darktable/build'
-    ],
-    extra_compile_args=extra_cflags
-)
+    """
+
+INCLUDE_DIRS = [
+    '/mnt/2t4/development/darktable/darktable/src',
+    '/mnt/2t4/development/darktable/darktable/src/cli/python_api',
+    '/mnt/2t4/development/darktable/darktable/build'
+]
+
+BUILD_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Optional LTO + profile-guided build of the extension (./build.sh pgo):
+# DT_API_PGO=generate builds it instrumented, a training run writes the
+# profiles to pgo/, and DT_API_PGO=use rebuilds from them. Unset for
+# normal, fast developer builds. libdt_api_shim.so is a separate shared
+# library, so this only reaches the cffi stubs, not the shim itself.
+PGO_DIR = os.path.join(BUILD_DIR, "pgo")
+PGO_MODE = os.environ.get("DT_API_PGO", "")
+if PGO_MODE == "generate":
+    PGO_ARGS = ['-flto', f'-fprofile-generate={PGO_DIR}']
+elif PGO_MODE == "use":
+    PGO_ARGS = ['-flto', f'-fprofile-use={PGO_DIR}', '-fprofile-correction']
+else:
+    PGO_ARGS = []
+
+EXTRA_LINK_ARGS = ['-Wl,-O1', '-Wl,--as-needed'] + PGO_ARGS
+
+def configure():
+    """Run pkg-config and set the extension's source - return its compile args
+
+    Only needed to build, so importing this module just to look at CDEF
+    forks nothing.
+    """
+    extra_cflags = get_pkg_config(['glib-2.0', 'gtk+-3.0', 'librsvg-2.0', 'json-glib-1.0'],
+                                  '--cflags')
+    extra_compile_args = extra_cflags + ['-O3', '-fno-plt', '-fvisibility=hidden'] + PGO_ARGS
+
+    # Specify the source for compilation.
+    # The generated wrappers drop the GIL around every C call (cffi does this
+    # for all functions, there is no per-function opt-in), so long calls such
+    # as dt_init, dt_image_import and dt_shim_storage_store already let other
+    # Python threads - timers, samplers, a pipelining thread - run meanwhile.
+    # No Py_BEGIN_ALLOW_THREADS trampolines are needed in dt_api_shim.c.
+    ffibuilder.set_source(
+        "_dt_api",
+        SOURCE,
+        libraries=['dt_api_shim', 'darktable'],
+        library_dirs=[
+            '/mnt/2t4/development/darktable/darktable/src/cli/python_api',
+            '/home/glen/Applications/Darktable/lib/darktable'
+        ],
+        runtime_library_dirs=[
+            '/mnt/2t4/development/darktable/darktable/src/cli/python_api',
+            '/home/glen/Applications/Darktable/lib/darktable'
+        ],
+        include_dirs=INCLUDE_DIRS,
+        # Only PyInit__dt_api needs exporting (PyMODINIT_FUNC keeps it visible);
+        # -fno-plt binds the libdarktable/shim calls through the GOT directly
+        extra_compile_args=extra_compile_args,
+        extra_link_args=EXTRA_LINK_ARGS
+    )
+    return extra_compile_args
+
+# Hash of the build inputs, stored next to the built extension; a rebuild
+# is skipped while it matches
+BUILD_HASH = os.path.join(BUILD_DIR, ".build_hash")
+
+def build_inputs_hash(extra_compile_args):
+    """cdef, source, flags and the mtimes of the headers SOURCE includes"""
+    headers = []
+    for name in re.findall(r'#include "([^"]+)"', SOURCE):
+        for include_dir in INCLUDE_DIRS:
+            path = os.path.join(include_dir, name)
+            if os.path.exists(path):
+                headers.append(path)
+                break
+    key = CDEF + SOURCE + " ".join(extra_compile_args + EXTRA_LINK_ARGS) + \
+        str(sorted((path, os.stat(path).st_mtime_ns) for path in headers))
+    return hashlib.blake2b(key.encode()).hexdigest()
 
 if __name__ == "__main__":
-    ffibuilder.compile(verbose=True)
+    digest = build_inputs_hash(configure())
+    built = glob.glob(os.path.join(BUILD_DIR, "_dt_api*.so"))
+    try:
+        with open(BUILD_HASH) as f:
+            up_to_date = bool(built) and f.read() == digest
+    except FileNotFoundError:
+        up_to_date = False
+
+    if up_to_date:
+        print(f"{built[0]} is up to date")
+    else:
+        ffibuilder.compile(tmpdir=BUILD_DIR, verbose=True)
+        with open(BUILD_HASH, 'w') as f:
+            f.write(digest)
@@ -9,6 +9,7 @@
 #include "common/metadata_export.h"
 #include "common/image_cache.h"
 #include <string.h>
+#include <sys/mman.h>
 
 // ============================================================================
 // Format Module Wrappers
@@ -220,3 +221,80 @@ void dt_shim_attach_buffer_to_image(dt_imgid_t imgid,
 
   dt_image_cache_write_release(img, DT_IMAGE_CACHE_RELAXED);
 }
+
+void dt_shim_detach_buffer_from_image(dt_imgid_t imgid)
+{
+  dt_image_t *img = dt_image_cache_get(imgid, 'w');
+  if(!img)
+  {
+    dt_print(DT_DEBUG_ALWAYS,
+             "[shim] detach_buffer: failed to get image %d", imgid);
+    return;
+  }
+
+  img->raw_buffer = NULL;
+  img->raw_buffer_size = 0;
+
+  dt_image_cache_write_release(img, DT_IMAGE_CACHE_RELAXED);
+}
+
+// Mappings made by dt_shim_attach_fd_to_image(), by image id, so that
+// dt_shim_detach_fd_from_image() unmaps only what the shim itself mapped
+typedef struct dt_shim_fd_map_t
+{
+  void *data;
+  size_t len;
+} dt_shim_fd_map_t;
+
+static GHashTable *_fd_maps = NULL;
+G_LOCK_DEFINE_STATIC(_fd_maps);
+
+static void _fd_map_free(gpointer data)
+{
+  dt_shim_fd_map_t *map = data;
+  munmap(map->data, map->len);
+  g_free(map);
+}
+
+void dt_shim_attach_fd_to_image(dt_imgid_t imgid, int fd, size_t len)
+{
+  if(fd < 0 || len == 0)
+  {
+    dt_print(DT_DEBUG_ALWAYS,
+             "[shim] attach_fd: invalid file descriptor");
+    return;
+  }
+
+  // Kept until dt_shim_detach_fd_from_image(): like an attached buffer, the
+  // image cache points at it. Pages fault in as the raw decoder reads them
+  void *data = mmap(NULL, len, PROT_READ, MAP_PRIVATE, fd, 0);
+  if(data == MAP_FAILED)
+  {
+    dt_print(DT_DEBUG_ALWAYS,
+             "[shim] attach_fd: failed to map %zu bytes for image %d", len, imgid);
+    return;
+  }
+  madvise(data, len, MADV_SEQUENTIAL);
+
+  dt_shim_attach_buffer_to_image(imgid, data, len);
+
+  dt_shim_fd_map_t *map = g_new(dt_shim_fd_map_t, 1);
+  map->data = data;
+  map->len = len;
+  G_LOCK(_fd_maps);
+  if(!_fd_maps)
+    _fd_maps = g_hash_table_new_full(NULL, NULL, NULL, _fd_map_free);
+  // replaces (and unmaps) an earlier mapping the image no longer points at
+  g_hash_table_insert(_fd_maps, GINT_TO_POINTER(imgid), map);
+  G_UNLOCK(_fd_maps);
+}
+
+void dt_shim_detach_fd_from_image(dt_imgid_t imgid)
+{
+  dt_shim_detach_buffer_from_image(imgid);
+
+  G_LOCK(_fd_maps);
+  if(_fd_maps)
+    g_hash_table_remove(_fd_maps, GINT_TO_POINTER(imgid));
+  G_UNLOCK(_fd_maps);
+}
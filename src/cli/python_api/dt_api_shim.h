@@ -89,6 +89,18 @@ void dt_shim_attach_buffer_to_image(dt_imgid_t imgid,
                                      const uint8_t *raw_buffer,
                                      size_t buffer_size);
 
+// Detach a buffer attached above: the image is read from its file again,
+// and the caller may free the buffer once this returns
+void dt_shim_detach_buffer_from_image(dt_imgid_t imgid);
+
+// Attach an open raw file to existing image: maps len bytes of fd read-only
+// and attaches the mapping, so no caller-side buffer has to be kept alive.
+// fd may be closed once this returns; the mapping stays until detached
+void dt_shim_attach_fd_to_image(dt_imgid_t imgid, int fd, size_t len);
+
+// Detach a file attached above and unmap it
+void dt_shim_detach_fd_from_image(dt_imgid_t imgid);
+
 #ifdef __cplusplus
 }
 #endif
@@ -7,199 +7,374 @@ This demonstrates the complete workflow:
 2. Import image into darktable with dummy filename
 3. Attach buffer to image (bypassing filesystem)
 4. Export to JPEG using darktable's full pipeline
+
+Raw files given on the command line are exported in turn, with the next
+PREFETCH_DEPTH files mapped and read ahead on a thread pool while the
+current one exports.
 """
 
+import logging
+import mmap
+import queue
 import sys
 import os
-from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 # Import the generated Python API
 from _dt_api import ffi, lib
-
-def main():
-    # Configuration
-    input_file = "/mnt/2t4/development/darktable/test_data/test1.ARW"
-    output_file = "/tmp/buffer_test_output.jpg"
-
-    print(f"[TEST] Starting buffer-based export test")
-    print(f"[TEST] Input: {input_file}")
-    print(f"[TEST] Output: {output_file}")
-
-    # Step 1: Load raw file into Python buffer
-    print(f"\n[TEST] Step 1: Loading raw file into memory buffer...")
+from _dt_test_util import build_argv, get_format, get_storage, cleanup
+
+# Bound once rather than looked up on lib/ffi per exported image
+_NULL = ffi.NULL
+_SRGB = lib.DT_COLORSPACE_SRGB
+_PERCEPTUAL = lib.DT_INTENT_PERCEPTUAL
+_store = lib.dt_shim_storage_store
+_film_new = lib.dt_shim_film_new
+_valid_film = lib.dt_is_valid_filmid
+_import = lib.dt_image_import
+_valid_img = lib.dt_is_valid_imgid
+_attach = lib.dt_shim_attach_buffer_to_image
+_detach = lib.dt_shim_detach_buffer_from_image
+_attach_fd = lib.dt_shim_attach_fd_to_image
+_detach_fd = lib.dt_shim_detach_fd_from_image
+_configure = lib.dt_shim_configure_export
+_from_buffer = ffi.from_buffer
+
+# Per-image progress is logged at DEBUG, so a batch run writes nothing per
+# image unless asked to: DT_LOG=DEBUG shows every step, DT_LOG=WARNING
+# leaves only errors
+logging.basicConfig(level=os.environ.get("DT_LOG", "INFO"), format="%(message)s",
+                    stream=sys.stdout)
+log = logging.getLogger("test_buffer_export")
+
+# Configuration
+# Paths are bytes throughout, encoded once, and passed to darktable as-is
+DEFAULT_INPUT = b"/mnt/2t4/development/darktable/test_data/test1.ARW"
+APPDIR = b"/home/glen/Applications/Darktable/bin"
+PREFETCH_DEPTH = 3  # raws mapped ahead of the export; bounds the pages in flight
+MAX_WIDTH = 1920
+MAX_HEIGHT = 1080
+
+# How load_raw() gets a raw into memory:
+#   'mmap'     - map the file itself; no copy, pages come from the page cache
+#   'hugepage' - read it into an anonymous buffer on 2 MB pages (fewer TLB
+#                misses while the decoder walks it); a ring of
+#                PREFETCH_DEPTH + 1 buffers, allocated once and refilled
+#                as each export is done
+#   'fd'       - only open it; dt_shim_attach_fd_to_image() maps it in C, so
+#                Python holds no buffer at all; the shim unmaps it on detach
+RAW_LOAD = 'mmap'
+
+_HUGE_PAGE = 2 << 20
+_MAP_HUGETLB = getattr(mmap, 'MAP_HUGETLB', 0x40000)  # Linux value; not every Python's mmap exports it
+_hugepages = queue.Queue()  # free buffers of the 'hugepage' ring
+
+# dt_init() argv with CLI-style arguments (like darktable-cli does),
+# built once at import and reused by every dt_init()
+_ARGC, _ARGV, _ARGV_KEEPALIVE = build_argv([
+    b"darktable-buffer-test",
+    b"--library",
+    b":memory:",  # Use in-memory database
+    b"--conf",
+    b"write_sidecar_files=never",
+])
+_ARGV_PTRS = [_ARGV[i] for i in range(_ARGC)]
+
+def alloc_hugepages(input_files):
+    """Fill the 'hugepage' ring: a buffer per raw in flight, plus the one
+    exporting, each sized to the largest input
+
+    Uses hugetlbfs pages where some are reserved, transparent huge pages
+    otherwise. The pages are faulted in by the first images only; later
+    ones reuse them.
+    """
+    largest = max(os.stat(p).st_size for p in input_files)
+    length = max(_HUGE_PAGE, -(-largest // _HUGE_PAGE) * _HUGE_PAGE)
+    for _ in range(min(PREFETCH_DEPTH + 1, len(input_files))):
+        try:
+            buf = mmap.mmap(-1, length, flags=mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS | _MAP_HUGETLB)
+        except OSError:  # no hugetlbfs pages reserved
+            buf = mmap.mmap(-1, length, flags=mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS)
+            if hasattr(buf, 'madvise'):
+                buf.madvise(mmap.MADV_HUGEPAGE)
+        _hugepages.put(buf)
+
+def free_hugepages():
+    """Unmap the 'hugepage' ring once every raw has been released"""
+    while not _hugepages.empty():
+        _hugepages.get_nowait().close()
+
+def read_raw_hugepage(input_file):
+    """Read a raw file into a free buffer of the ring (RAW_LOAD 'hugepage')
+
+    Waits for release_raw() to hand one back if all are in use, and fills
+    it with preadv() straight from the fd.
+    """
+    buf = _hugepages.get()
+    fd = os.open(input_file, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        if size > len(buf):
+            raise ValueError(f"{os.fsdecode(input_file)} grew past the hugepage buffers")
+        with memoryview(buf) as view:
+            offset = 0
+            while offset < size:
+                n = os.preadv(fd, [view[offset:size]], offset)
+                if n == 0:
+                    break
+                offset += n
+        return memoryview(buf)[:offset]
+    except BaseException:
+        _hugepages.put(buf)
+        raise
+    finally:
+        os.close(fd)
+
+class RawFd:
+    """An open raw file for dt_shim_attach_fd_to_image() (RAW_LOAD 'fd')"""
+
+    def __init__(self, input_file):
+        self.fd = os.open(input_file, os.O_RDONLY)
+        self.size = os.fstat(self.fd).st_size
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(self.fd, 0, 0, os.POSIX_FADV_WILLNEED)
+
+    def __len__(self):
+        return self.size
+
+def load_raw(input_file):
+    """Map a raw file read-only and start reading it in (loader thread)
+
+    No read() copy into a bytes object: darktable reads the mapping, and
+    MADV_WILLNEED has the kernel pull the file into the page cache now,
+    while the previous image is still exporting.
+    """
+    if RAW_LOAD == 'hugepage':
+        return read_raw_hugepage(input_file)
+    if RAW_LOAD == 'fd':
+        return RawFd(input_file)
     with open(input_file, 'rb') as f:
-        raw_data = f.read()
-
-    print(f"[TEST] Loaded {len(raw_data):,} bytes into Python buffer")
-
-    # Step 2: Initialize darktable
-    print(f"\n[TEST] Step 2: Initializing darktable...")
+        raw_data = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+    if hasattr(raw_data, 'madvise'):
+        raw_data.madvise(mmap.MADV_SEQUENTIAL)  # the raw decoders read front to back
+        raw_data.madvise(mmap.MADV_WILLNEED)
+    return raw_data
+
+def release_raw(raw_data):
+    """Free what load_raw() returned, once process_one() is done with it"""
+    if isinstance(raw_data, RawFd):
+        os.close(raw_data.fd)  # the shim's mapping was its own
+    elif isinstance(raw_data, memoryview):  # 'hugepage'
+        buf = raw_data.obj
+        raw_data.release()
+        _hugepages.put(buf)  # back into the ring for the next raw
+    else:
+        raw_data.close()
+
+def process_one(input_file, raw_data, output_file, export):
+    """Import, attach the pre-loaded raw_data and export one image"""
+    format_module, storage_module, format_data, storage_data = export
+
+    # Create film (directory) entry for input directory
+    import_dir = os.path.dirname(input_file)
+    filmid = _film_new(import_dir)
+
+    if not _valid_film(filmid):
+        log.error("[TEST] ERROR: Failed to create film for %s", os.fsdecode(import_dir))
+        return 1
 
-    # Create argv with CLI-style arguments (like darktable-cli does)
-    argv = [
-        ffi.new("char[]", b"darktable-buffer-test"),
-        ffi.new("char[]", b"--library"),
-        ffi.new("char[]", b":memory:"),  # Use in-memory database
-        ffi.new("char[]", b"--conf"),
-        ffi.new("char[]", b"write_sidecar_files=never"),
-    ]
-    argc = len(argv)
+    # Import image with REAL filename (darktable reads EXIF from the file)
+    imgid = _import(
+        filmid,
+        input_file,
+        False,  # override_ignore_jpegs
+        False   # check_duplicates
+    )
 
-    # Initialize darktable (no GUI, load data)
-    # Use applicationdir parameter to point to installation (Phase 1 fix)
-    ret = lib.dt_init(argc, argv, False, True, ffi.NULL,
-                      b"/home/glen/Applications/Darktable/bin")
-    if ret != 0:
-        print(f"[TEST] ERROR: dt_init failed with code {ret}")
+    if not _valid_img(imgid):
+        log.error("[TEST] ERROR: Failed to import image")
         return 1
 
-    print(f"[TEST] darktable initialized successfully")
+    log.debug("[TEST] Image imported: ID=%s", imgid)
 
-    try:
-        # Step 3: Create film (directory) entry for input directory
-        import_dir = os.path.dirname(input_file)
-        print(f"\n[TEST] Step 3: Creating film entry for {import_dir}...")
-        filmid = lib.dt_shim_film_new(import_dir.encode('utf-8'))
+    # Attach buffer to image (export uses it instead of re-reading from disk)
+    # Create a CFFI buffer over the mapping (read-only, no copy)
+    # IMPORTANT: raw_data must remain alive for the duration of export!
+    # The image cache keeps the pointer, so it is detached again right
+    # after the export, before main() frees raw_data (release_raw())
+    if isinstance(raw_data, RawFd):
+        _attach_fd(imgid, raw_data.fd, len(raw_data))
+        buffer_ptr = None
+    else:
+        buffer_ptr = _from_buffer("uint8_t[]", raw_data)
+        _attach(imgid, buffer_ptr, len(raw_data))
 
-        if not lib.dt_is_valid_filmid(filmid):
-            print(f"[TEST] ERROR: Failed to create film for {import_dir}")
-            return 1
+    log.debug("[TEST] Attached %d byte buffer to image %s", len(raw_data), imgid)
 
-        print(f"[TEST] Film created: ID={filmid}")
-
-        # Step 4: Import image with REAL filename (for EXIF extraction)
-        print(f"\n[TEST] Step 4: Importing image from {input_file}...")
-        print(f"[TEST] (EXIF will be read from disk now)")
+    try:
+        # Configure paths and dimensions
+        _configure(
+            storage_data,
+            format_data,
+            output_file,
+            MAX_WIDTH,
+            MAX_HEIGHT
+        )
 
-        # Import the image (darktable will read EXIF from the actual file)
-        imgid = lib.dt_image_import(
-            filmid,
-            input_file.encode('utf-8'),
-            False,  # override_ignore_jpegs
-            False   # check_duplicates
+        export_ret = _store(
+            storage_module,
+            storage_data,
+            imgid,
+            format_module,
+            format_data,
+            1,      # num (image 1 of N)
+            1,      # total (1 image)
+            True,   # high_quality
+            False,  # allow_upscale
+            False,  # export_masks
+            _SRGB,        # icc_type
+            _NULL,        # icc_file (use default)
+            _PERCEPTUAL   # icc_intent
         )
+    finally:
+        # Any later load of this image reads the file instead
+        if buffer_ptr is None:
+            _detach_fd(imgid)  # also unmaps the shim's mapping
+        else:
+            _detach(imgid)
+            ffi.release(buffer_ptr)
 
-        if not lib.dt_is_valid_imgid(imgid):
-            print(f"[TEST] ERROR: Failed to import image")
-            return 1
+    if export_ret != 0:
+        log.error("[TEST] ERROR: Export failed with code %s", export_ret)
+        return 1
 
-        print(f"[TEST] Image imported: ID={imgid}")
+    # Verify output
+    try:
+        size = os.stat(output_file).st_size
+    except FileNotFoundError:
+        log.error("[TEST] ERROR: Output file not created!")
+        return 1
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("[TEST] ✓ Output file created: %s", os.fsdecode(output_file))
+        log.debug("[TEST] ✓ Output size: %d bytes", size)
 
-        # Step 5: Attach buffer to image
-        print(f"\n[TEST] Step 5: Attaching {len(raw_data):,} byte buffer to image...")
-        print(f"[TEST] (Export will use this buffer instead of re-reading from disk)")
+    return 0
 
-        # Create a CFFI buffer from Python bytes
-        # IMPORTANT: raw_data must remain alive for the duration of export!
-        buffer_ptr = ffi.from_buffer("uint8_t[]", raw_data)
+def main():
+    input_files = [os.fsencode(p) for p in sys.argv[1:]] or [DEFAULT_INPUT]
+    if len(input_files) == 1:
+        output_files = [b"/tmp/buffer_test_output.jpg"]
+    else:
+        output_files = [b"/tmp/buffer_test_output_%s.jpg" % os.path.splitext(os.path.basename(p))[0]
+                        for p in input_files]
+
+    log.info("[TEST] Starting buffer-based export test")
+    if log.isEnabledFor(logging.DEBUG):
+        for input_file, output_file in zip(input_files, output_files):
+            log.debug("[TEST] Input: %s -> Output: %s",
+                      os.fsdecode(input_file), os.fsdecode(output_file))
+
+    # Step 1: Initialize darktable
+    log.info("\n[TEST] Step 1: Initializing darktable...")
 
-        # Attach buffer to the image
-        lib.dt_shim_attach_buffer_to_image(imgid, buffer_ptr, len(raw_data))
+    # Initialize darktable (no GUI, load data)
+    # Use applicationdir parameter to point to installation (Phase 1 fix)
+    _ARGV[0:_ARGC] = _ARGV_PTRS  # dt_init() NULLs the entries it consumes
+    ret = lib.dt_init(_ARGC, _ARGV, False, True, ffi.NULL, APPDIR)
+    if ret != 0:
+        log.error("[TEST] ERROR: dt_init failed with code %s", ret)
+        return 1
 
-        print(f"[TEST] Buffer attached to image {imgid}")
+    log.info("[TEST] darktable initialized successfully")
 
-        # Step 6: Set up export modules
-        print(f"\n[TEST] Step 6: Setting up export modules...")
+    try:
+        # Step 2: Set up export modules (once, reconfigured per image)
+        log.info("\n[TEST] Step 2: Setting up export modules...")
 
         # Get JPEG format module
-        format_module = lib.dt_imageio_get_format_by_name(b"jpeg")
+        format_module = get_format(b"jpeg")
         if format_module == ffi.NULL:
-            print(f"[TEST] ERROR: Failed to get JPEG format module")
+            log.error("[TEST] ERROR: Failed to get JPEG format module")
             return 1
 
         # Get disk storage module
-        storage_module = lib.dt_imageio_get_storage_by_name(b"disk")
+        storage_module = get_storage(b"disk")
         if storage_module == ffi.NULL:
-            print(f"[TEST] ERROR: Failed to get disk storage module")
+            log.error("[TEST] ERROR: Failed to get disk storage module")
             return 1
 
-        print(f"[TEST] Export modules loaded")
-
-        # Step 7: Get module parameters
-        print(f"\n[TEST] Step 7: Getting module parameters...")
-
         format_data = lib.dt_shim_format_get_params(format_module)
         storage_data = lib.dt_shim_storage_get_params(storage_module)
 
         if format_data == ffi.NULL or storage_data == ffi.NULL:
-            print(f"[TEST] ERROR: Failed to get module parameters")
+            log.error("[TEST] ERROR: Failed to get module parameters")
             return 1
 
-        print(f"[TEST] Module parameters acquired")
-
-        # Step 8: Configure export
-        print(f"\n[TEST] Step 8: Configuring export parameters...")
-
-        # Configure paths and dimensions
-        lib.dt_shim_configure_export(
-            storage_data,
-            format_data,
-            output_file.encode('utf-8'),
-            1920,  # max_width
-            1080   # max_height
-        )
-
-        print(f"[TEST] Export configured: {output_file} (max 1920x1080)")
-
-        # Step 9: Export the image
-        print(f"\n[TEST] Step 9: Exporting image...")
-        print(f"[TEST] This will test if darktable reads from buffer instead of filesystem")
-
-        export_ret = lib.dt_shim_storage_store(
-            storage_module,
-            storage_data,
-            imgid,
-            format_module,
-            format_data,
-            1,      # num (image 1 of N)
-            1,      # total (1 image)
-            True,   # high_quality
-            False,  # allow_upscale
-            False,  # export_masks
-            lib.DT_COLORSPACE_SRGB,  # icc_type
-            ffi.NULL,                 # icc_file (use default)
-            lib.DT_INTENT_PERCEPTUAL  # icc_intent
-        )
-
-        if export_ret != 0:
-            print(f"[TEST] ERROR: Export failed with code {export_ret}")
-            return 1
-
-        print(f"[TEST] Export completed successfully!")
-
-        # Step 10: Verify output
-        print(f"\n[TEST] Step 10: Verifying output...")
-
-        if os.path.exists(output_file):
-            size = os.path.getsize(output_file)
-            print(f"[TEST] ✓ Output file created: {output_file}")
-            print(f"[TEST] ✓ Output size: {size:,} bytes")
-        else:
-            print(f"[TEST] ERROR: Output file not created!")
-            return 1
+        log.info("[TEST] Export modules and parameters acquired")
+        export = (format_module, storage_module, format_data, storage_data)
+
+        # Step 3: Export each image while the next ones load
+        log.info("\n[TEST] Step 3: Exporting %d image(s), prefetching %d ahead...",
+                 len(input_files), PREFETCH_DEPTH)
+
+        failures = 0
+        if RAW_LOAD == 'hugepage':
+            alloc_hugepages(input_files)
+        with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as loader:
+            # Only PREFETCH_DEPTH loads are submitted ahead of the export,
+            # in order, so at most that many raws are in flight. The loader
+            # threads keep running during dt_shim_storage_store(): cffi
+            # calls it with the GIL released (see build_dt_api.py)
+            pending = deque()
+            queued = iter(zip(input_files, output_files))
+            for input_file, output_file in queued:
+                pending.append((input_file, output_file, loader.submit(load_raw, input_file)))
+                if len(pending) == PREFETCH_DEPTH:
+                    break
+
+            while pending:
+                input_file, output_file, future = pending.popleft()
+                for next_input, next_output in queued:
+                    pending.append((next_input, next_output, loader.submit(load_raw, next_input)))
+                    break
+
+                raw_data = future.result()
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug("\n[TEST] %s: %d bytes mapped",
+                              os.fsdecode(input_file), len(raw_data))
+                try:
+                    failures += process_one(input_file, raw_data, output_file, export)
+                finally:
+                    release_raw(raw_data)
+        free_hugepages()
 
         # Cleanup
-        print(f"\n[TEST] Cleaning up...")
+        log.info("\n[TEST] Cleaning up...")
         lib.dt_shim_format_free_params(format_module, format_data)
         lib.dt_shim_storage_free_params(storage_module, storage_data)
         lib.dt_shim_storage_finalize(storage_module, storage_data)
 
+        if failures:
+            log.error("[TEST] ERROR: %d of %d export(s) failed", failures, len(input_files))
+            return 1
+
     finally:
         # Always cleanup darktable
-        print(f"\n[TEST] Shutting down darktable...")
-        lib.dt_cleanup()
-
-    print(f"\n[TEST] ========================================")
-    print(f"[TEST] SUCCESS! Buffer-based export completed")
-    print(f"[TEST] ========================================")
-    print(f"[TEST] Workflow:")
-    print(f"[TEST] 1. Imported image from disk (for EXIF metadata)")
-    print(f"[TEST] 2. Attached pre-loaded buffer to image")
-    print(f"[TEST] 3. Export used buffer instead of re-reading file")
-    print(f"[TEST]")
-    print(f"[TEST] This enables parallel I/O optimization:")
-    print(f"[TEST] - Python can load files in parallel from slow storage")
-    print(f"[TEST] - Darktable processes from fast RAM buffers")
+        log.info("\n[TEST] Shutting down darktable...")
+        cleanup()
+
+    log.info("\n[TEST] ========================================")
+    log.info("[TEST] SUCCESS! Buffer-based export completed")
+    log.info("[TEST] ========================================")
+    log.info("[TEST] Workflow:")
+    log.info("[TEST] 1. Imported image from disk (for EXIF metadata)")
+    log.info("[TEST] 2. Attached pre-loaded buffer to image")
+    log.info("[TEST] 3. Export used buffer instead of re-reading file")
+    log.info("[TEST]")
+    log.info("[TEST] Parallel I/O optimization:")
+    log.info("[TEST] - Python loads the next files in parallel from slow storage")
+    log.info("[TEST] - Darktable processes from fast RAM buffers")
 
     return 0
 
@@ -7,6 +7,29 @@ This tests the full workflow: init -> import -> export -> cleanup
 
 import os
 from _dt_api import ffi, lib
+from _dt_test_util import build_argv, get_format, get_storage, cleanup
+
+# Paths pre-encoded once; os.path works on bytes directly
+INPUT_FILE = b"/mnt/2t4/development/darktable/test_data/test - 3.ARW"
+INPUT_DIR = os.path.dirname(INPUT_FILE)
+OUTPUT_FILE = b"/tmp/test_dt_api_output.jpg"
+APPDIR = b"/home/glen/Applications/Darktable/bin"
+
+# Bound once rather than looked up on lib/ffi per export
+_NULL = ffi.NULL
+_SRGB = lib.DT_COLORSPACE_SRGB
+_PERCEPTUAL = lib.DT_INTENT_PERCEPTUAL
+_store = lib.dt_shim_storage_store
+
+# dt_init() arguments, built once at import and reused by every dt_init()
+_ARGC, _ARGV, _ARGV_KEEPALIVE = build_argv([
+    b"darktable-api",
+    b"--library",
+    b":memory:",
+    b"--conf",
+    b"write_sidecar_files=never",
+])
+_ARGV_PTRS = [_ARGV[i] for i in range(_ARGC)]
 
 def test_basic_workflow():
     """Test basic init/import/export/cleanup"""
@@ -16,17 +39,8 @@ def test_basic_workflow():
 
     # 1. Initialize darktable
     print("\n1. Initializing darktable...")
-    argv = [
-        ffi.new("char[]", b"darktable-api"),
-        ffi.new("char[]", b"--library"),
-        ffi.new("char[]", b":memory:"),
-        ffi.new("char[]", b"--conf"),
-        ffi.new("char[]", b"write_sidecar_files=never"),
-    ]
-    argv_array = ffi.new("char*[]", argv)
-
-    result = lib.dt_init(5, argv_array, False, True, ffi.NULL,
-                         b"/home/glen/Applications/Darktable/bin")
+    _ARGV[0:_ARGC] = _ARGV_PTRS  # dt_init() NULLs the entries it consumes
+    result = lib.dt_init(_ARGC, _ARGV, False, True, ffi.NULL, APPDIR)
     if result != 0:
         print(f"✗ dt_init failed with code {result}")
         return 1
@@ -34,36 +48,33 @@ def test_basic_workflow():
 
     # 2. Import image
     print("\n2. Importing image...")
-    input_path = b"/mnt/2t4/development/darktable/test_data/test - 3.ARW"
-
-    if not lib.dt_supported_image(input_path):
-        print(f"✗ Image format not supported: {input_path.decode()}")
-        lib.dt_cleanup()
+    if not lib.dt_supported_image(INPUT_FILE):
+        print(f"✗ Image format not supported: {INPUT_FILE.decode()}")
+        cleanup()
         return 2
 
-    directory = os.path.dirname(input_path.decode()).encode()
-    filmid = lib.dt_shim_film_new(directory)
+    filmid = lib.dt_shim_film_new(INPUT_DIR)
 
     if not lib.dt_is_valid_filmid(filmid):
-        print(f"✗ Failed to create film for {directory.decode()}")
-        lib.dt_cleanup()
+        print(f"✗ Failed to create film for {INPUT_DIR.decode()}")
+        cleanup()
         return 3
 
-    imgid = lib.dt_image_import(filmid, input_path, True, True)
+    imgid = lib.dt_image_import(filmid, INPUT_FILE, True, True)
     if not lib.dt_is_valid_imgid(imgid):
         print(f"✗ Failed to import image")
-        lib.dt_cleanup()
+        cleanup()
         return 4
     print(f"✓ Image imported (imgid={imgid})")
 
     # 3. Setup export
     print("\n3. Setting up export modules...")
-    format_mod = lib.dt_imageio_get_format_by_name(b"jpeg")
-    storage_mod = lib.dt_imageio_get_storage_by_name(b"disk")
+    format_mod = get_format(b"jpeg")
+    storage_mod = get_storage(b"disk")
 
     if not format_mod or not storage_mod:
         print("✗ Failed to get format/storage modules")
-        lib.dt_cleanup()
+        cleanup()
         return 5
 
     fdata = lib.dt_shim_format_get_params(format_mod)
@@ -71,37 +82,36 @@ def test_basic_workflow():
 
     if not fdata or not sdata:
         print("✗ Failed to get module parameters")
-        lib.dt_cleanup()
+        cleanup()
         return 6
     print("✓ Export modules configured")
 
     # 4. Configure output
     print("\n4. Configuring export...")
-    output_path = b"/tmp/test_dt_api_output.jpg"
-    lib.dt_shim_configure_export(sdata, fdata, output_path, 1920, 1080)
-    print(f"✓ Output: {output_path.decode()} (1920x1080)")
+    lib.dt_shim_configure_export(sdata, fdata, OUTPUT_FILE, 1920, 1080)
+    print(f"✓ Output: {OUTPUT_FILE.decode()} (1920x1080)")
 
     # 5. Export
     print("\n5. Exporting image...")
-    export_result = lib.dt_shim_storage_store(
+    export_result = _store(
         storage_mod, sdata, imgid, format_mod, fdata,
         1, 1,          # num, total
         True,          # high_quality
         False,         # allow_upscale
         False,         # export_masks
-        1,             # DT_COLORSPACE_SRGB
-        ffi.NULL,      # icc_file
-        0              # DT_INTENT_PERCEPTUAL
+        _SRGB,         # icc_type
+        _NULL,         # icc_file
+        _PERCEPTUAL    # icc_intent
     )
 
     if export_result != 0:
         print(f"✗ Export failed with code {export_result}")
     else:
         print("✓ Export completed")
-        if os.path.exists(output_path.decode()):
-            size = os.path.getsize(output_path.decode())
+        try:
+            size = os.stat(OUTPUT_FILE).st_size
             print(f"✓ Output file created: {size:,} bytes")
-        else:
+        except FileNotFoundError:
             print("✗ Output file not found!")
             export_result = 99
 
@@ -110,7 +120,7 @@ def test_basic_workflow():
     lib.dt_shim_storage_finalize(storage_mod, sdata)
     lib.dt_shim_storage_free_params(storage_mod, sdata)
     lib.dt_shim_format_free_params(format_mod, fdata)
-    lib.dt_cleanup()
+    cleanup()
     print("✓ Cleanup complete")
 
     # Final result
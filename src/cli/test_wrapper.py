@@ -2,10 +2,22 @@
 """
 Test the dt_cli_process_simple cffi wrapper - Phase 1.
 No launcher needed - applicationdir passed directly to dt_init!
+
+With raw files on the command line, exports them all through one
+dt_cli_process_many() call instead.
 """
 
 import os
-from _dt_cli_wrapper import lib
+import sys
+
+try:
+    from _dt_cli_wrapper import ffi, lib  # API mode, built by build_wrapper.py
+except ImportError:
+    from _dt_cli_abi import ffi, lib  # ABI mode, only needs libdt_cli_wrapper.so
+
+# The string packing is shared with the Phase 2 test scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "python_api"))
+from _dt_test_util import pack_strings
 
 def test_process_image():
     input_path = b"/mnt/2t4/development/darktable/test_data/test - 3.ARW"
@@ -40,6 +52,39 @@ def test_process_image():
     print("=" * 60)
     return result
 
+def test_process_many(input_paths):
+    output_paths = [b"/tmp/test_output_%s.jpg" % os.path.splitext(os.path.basename(p))[0]
+                    for p in input_paths]
+    n = len(input_paths)
+
+    print("=" * 60)
+    print("Phase 1 cffi Wrapper Test (batch)")
+    print("=" * 60)
+    for input_path, output_path in zip(input_paths, output_paths):
+        print(f"{input_path.decode()} -> {output_path.decode()}")
+    print("-" * 60)
+
+    # One Python -> C crossing (and one dt_init) for the whole batch
+    inputs, inputs_keepalive = pack_strings(ffi, input_paths, terminate=False)
+    outputs, outputs_keepalive = pack_strings(ffi, output_paths, terminate=False)
+    widths = ffi.new("int[]", [1920] * n)
+    heights = ffi.new("int[]", [1080] * n)
+    failures = lib.dt_cli_process_many(inputs, outputs, widths, heights, n)
+
+    print("-" * 60)
+    if failures < 0:
+        print("✗ ERROR: darktable/export setup failed")
+        result = 1
+    else:
+        print(f"✓ {n - failures} of {n} images processed")
+        result = 1 if failures else 0
+
+    print("=" * 60)
+    return result
+
 if __name__ == "__main__":
-    exit_code = test_process_image()
+    if len(sys.argv) > 1:
+        exit_code = test_process_many([os.fsencode(p) for p in sys.argv[1:]])
+    else:
+        exit_code = test_process_image()
     exit(exit_code)